@@ -0,0 +1,132 @@
+"""
+Maintenance commands, run from the application root:
+
+    python cli.py <command> [options]
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+from pprint import pprint
+from uuid import uuid4
+
+import database
+import storage
+from const import ROLL_FORWARD
+from indexes import ensure_indexes
+from utils import scheduler
+from utils.functions import backfill_reference_names
+from utils.roll_forward import roll_forward
+from utils.rollups import rebuild_rollups
+from utils.search import backfill_search_fields
+
+
+async def backfill_names(args: argparse.Namespace) -> dict:
+    return await backfill_reference_names(database.get_database())
+
+
+async def backfill_search(args: argparse.Namespace) -> dict:
+    return await backfill_search_fields(database.get_database(), args.batch_size)
+
+
+async def create_indexes(args: argparse.Namespace) -> dict:
+    return await ensure_indexes(database.get_database())
+
+
+async def rebuild_dashboard_rollups(args: argparse.Namespace) -> dict:
+    return await rebuild_rollups(database.get_database(), args.batch_size)
+
+
+async def roll_forward_due_dates(args: argparse.Namespace) -> dict | str:
+    report = await scheduler.run_job(
+        database.get_database(), "roll_forward",
+        lambda db: roll_forward(db, args.batch_size), ROLL_FORWARD["lease"])
+    return report if report is not None else "Another worker is running the roll-forward"
+
+
+async def job_runs(args: argparse.Namespace) -> list[dict]:
+    """Reports of the latest background job runs of every group, newest first"""
+    query = {"job": args.job} if args.job else {}
+    runs = database.get_database().job_runs.find(query, {"_id": 0}).sort("started_at", -1).limit(args.limit)
+    return await runs.to_list(None)
+
+
+async def benchmark_storage(args: argparse.Namespace) -> dict:
+    """Time the upload, link (move with tags) and delete of files of args.size bytes"""
+    files = storage.get_storage()
+    content = os.urandom(args.size)
+    timings = {"upload": 0.0, "link": 0.0, "delete": 0.0}
+    for _ in range(args.count):
+        upload = os.path.join("benchmarks", "uploads", uuid4().hex)
+        linked = os.path.join("benchmarks", "linked", uuid4().hex)
+        started = time.perf_counter()
+        files.upload_fileobj(io.BytesIO(content), upload, {"Tagging": "status=unlinked"})
+        uploaded = time.perf_counter()
+        files.move_object(upload, linked, {"status": "linked"})
+        linked_at = time.perf_counter()
+        files.delete_object(upload)
+        files.delete_object(linked)
+        timings["upload"] += uploaded - started
+        timings["link"] += linked_at - uploaded
+        timings["delete"] += time.perf_counter() - linked_at
+    return {
+        "backend": type(files).__name__,
+        "count": args.count,
+        **{f"{operation}_ms": round(seconds / args.count * 1000, 2) for operation, seconds in timings.items()}
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    try:
+        pprint(await args.handler(args))
+    finally:
+        database.close()
+        storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ConTrack maintenance commands")
+    subparsers = parser.add_subparsers(required=True)
+
+    command = subparsers.add_parser(
+        "backfill-names", help="Copy category and responsible names onto the contracts")
+    command.set_defaults(handler=backfill_names)
+
+    command = subparsers.add_parser(
+        "backfill-search", help="Store the normalized search fields on the contracts")
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.set_defaults(handler=backfill_search)
+
+    command = subparsers.add_parser(
+        "ensure-indexes", help="Create the missing indexes of the catalogue")
+    command.set_defaults(handler=create_indexes)
+
+    command = subparsers.add_parser(
+        "rebuild-rollups", help="Recompute the monthly dashboard rollups of every group. "
+                                "Stop the contract writes first, a change made meanwhile may be lost")
+    command.add_argument("--batch-size", type=int, default=1000)
+    command.set_defaults(handler=rebuild_dashboard_rollups)
+
+    command = subparsers.add_parser(
+        "roll-forward", help="Advance the passed due dates of the active contracts")
+    command.add_argument("--batch-size", type=int, default=ROLL_FORWARD["batch_size"])
+    command.set_defaults(handler=roll_forward_due_dates)
+
+    command = subparsers.add_parser(
+        "job-runs", help="Show the reports of the latest background job runs")
+    command.add_argument("--job", help="Only the runs of this job, e.g. roll_forward")
+    command.add_argument("--limit", type=int, default=20)
+    command.set_defaults(handler=job_runs)
+
+    command = subparsers.add_parser(
+        "benchmark-storage", help="Time the upload, link and delete of files on the configured storage")
+    command.add_argument("--count", type=int, default=20)
+    command.add_argument("--size", type=int, default=1024 * 1024)
+    command.set_defaults(handler=benchmark_storage)
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,69 @@ APPLICATION_CODE = "contrack"
 
 DGAPI_SERVER = "10.31.151.105:5000"
 
+# DGAPI HTTP client, shared keep-alive pool per worker process (seconds)
+DGAPI_CLIENT = {
+    "max_connections": 50,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30,
+    "connect_timeout": 2.0,
+    "read_timeout": 10.0,
+    "retries": 2,
+    "backoff": 0.1,  # base delay of the jittered exponential backoff
+    "backoff_max": 1.0,
+    "breaker_failures": 5,  # consecutive failures that open the circuit
+    "breaker_reset": 30,  # time the circuit stays open before a trial request
+}
+
 # AWS
 AWS_S3_BUCKET_NAME = "contrack-storage"
 AWS_S3_ROOT_FOLDER = "dev"
 
+# File storage, "s3" or "local" (files under local_root, for development and
+# benchmarks without AWS). The S3 client is shared by the whole process.
+STORAGE = {
+    "backend": "s3",
+    "max_pool_connections": 50,
+    "connect_timeout": 2.0,
+    "read_timeout": 10.0,
+    "retries": 3,  # total attempts of the standard retry mode
+    "local_root": "storage",
+    "local_url": "http://localhost:5041/storage",
+}
+
+# Contract file uploads, sent by the clients straight to the bucket through
+# a presigned request that expires after "expiry" seconds
+FILE_UPLOADS = {
+    "max_size": 25 * 1024 * 1024,
+    "content_types": [
+        "application/pdf",
+        "image/jpeg",
+        "image/png",
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ],
+    "expiry": 900,
+}
+
+# Files linked to contracts: most files per contract, most files per batch
+# link or unlink, and threads running the storage calls of the batches
+FILE_LINKS = {
+    "max_files": 20,
+    "max_batch": 100,
+    "workers": 16,
+}
+
+# Presigned download URLs of the linked files (seconds). A URL is reused from
+# the per-worker cache for at most cache_ttl, so it is always handed out with
+# at least expiry - cache_ttl seconds left.
+FILE_DOWNLOADS = {
+    "expiry": 900,
+    "cache_ttl": 600,
+    "max_size": 10000,
+}
+
 # MongoDB
 MONGO_CON = {
     "user": "contrackAdmin",
@@ -15,3 +74,80 @@ MONGO_CON = {
     "database": "contrack_dev",
     "port": 27017,
 }
+
+# MongoDB connection pool, shared by every request of a worker process
+MONGO_POOL = {
+    "maxPoolSize": 100,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 300000,
+    "waitQueueTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 5000,
+}
+
+# DGAPI token validation cache (seconds)
+TOKEN_CACHE = {
+    "max_size": 10000,
+    "ttl": 60,  # how long a successful validation is trusted
+    "negative_ttl": 10,  # how long a rejected token is remembered
+    "stale_ttl": 300,  # extra time a valid entry is served while DGAPI fails, 0 disables
+    "exp_margin": 30,  # entries always expire this long before the JWT exp claim
+}
+
+# Largest page a paginated listing will serve
+MAX_PAGE_SIZE = 500
+# Results returned by a contract search when no limit is given
+SEARCH_LIMIT = 20
+# Widest window, in days, the alerts endpoint accepts
+MAX_ALERT_DAYS = 366
+
+# Annual dashboard: default lower bounds of the value ranges and widest year range
+VALUE_RANGE_BOUNDS = [0, 1001, 5001, 10001]
+MAX_DASHBOARD_YEARS = 10
+
+# Cursor batch size of the streaming contract export
+EXPORT_BATCH_SIZE = 500
+MAX_EXPORT_BATCH_SIZE = 5000
+
+# Rows validated and inserted per batch by the contract import, and the
+# largest number of invalid rows reported
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 1000
+
+# Contracts read and changed per chunk by the bulk update and delete
+BULK_BATCH_SIZE = 1000
+
+# Background roll-forward of passed due dates (seconds). The lease must
+# outlast a run, it keeps the other workers from running it concurrently;
+# after a run it is held for the interval, so the job runs once per interval.
+ROLL_FORWARD = {
+    "enabled": True,
+    "interval": 3600,
+    "lease": 900,
+    "batch_size": 500,
+}
+
+# Daily upcoming-due digests of the alerts (seconds). Alerts for up to "days"
+# days are served from the digest, a group with more than max_rows
+# contracts due in that window is always computed live.
+ALERT_DIGEST = {
+    "enabled": True,
+    "days": 90,
+    "max_rows": 5000,
+    "interval": 3600,
+    "lease": 900,
+    "debounce": 5,
+}
+
+# Per-worker cache of categories, responsibles and contract fields (seconds)
+REFERENCE_CACHE = {
+    "max_size": 5000,
+    "ttl": 300,
+    "watch_retry": 5,  # delay before reopening an interrupted change stream
+}
+
+# Cached dashboard and alert responses, shared through Redis when a URL is set
+RESPONSE_CACHE = {
+    "max_size": 2000,
+    "ttl": 300,
+    "redis_url": None,  # e.g. "redis://localhost:6379/0"
+}
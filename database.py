@@ -1,14 +1,58 @@
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo import MongoClient
 
-from const import MONGO_CON
+from const import MONGO_CON, MONGO_POOL
+
+_client: AsyncIOMotorClient | None = None
+
+
+def client_options(conf: dict | None = None, pool: dict | None = None) -> dict:
+    """Keyword arguments shared by the sync and async Mongo clients"""
+    conf = conf or MONGO_CON
+    pool = pool or MONGO_POOL
+    return {
+        "host": conf["host"],
+        "port": conf["port"],
+        "username": conf["user"],
+        "password": conf["password"],
+        "authSource": conf["database"],
+        **pool
+    }
+
+
+def create_client(conf: dict | None = None, pool: dict | None = None) -> AsyncIOMotorClient:
+    """Build a pool-configured async client for the given connection settings"""
+    return AsyncIOMotorClient(**client_options(conf, pool))
+
+
+def connect() -> AsyncIOMotorClient:
+    """Create the process-wide client if it does not exist yet and return it"""
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def close() -> None:
+    """Close the process-wide client and release its connection pool"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_database() -> AsyncIOMotorDatabase:
+    """Return the application database using the shared client"""
+    return connect()[MONGO_CON["database"]]
 
 
 class MongoCon:
+    """Short-lived connection for standalone scripts, closed on exit"""
+
     def __init__(self, conf=None):
         conf = conf or MONGO_CON
         self.conf = conf
-        self.cnx = MongoClient(
-            conf["host"], conf["port"], username=conf["user"], password=conf["password"], authSource=conf["database"])
+        self.cnx = MongoClient(**client_options(conf))
 
     def db(self):
         return self.cnx[self.conf["database"]]
@@ -1,110 +1,44 @@
-import os
-from typing import Any, BinaryIO, Generator
+import hashlib
+import time
 
-import boto3
 import jwt
-from botocore.exceptions import ClientError
-from fastapi import Depends, Header, HTTPException, Request, status
-
-from const import AWS_S3_BUCKET_NAME, AWS_S3_ROOT_FOLDER
-from database import MongoCon
-from dgapi import DGAPI as DGAPIBase
+from fastapi import Depends, Header, HTTPException, Query, Request, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+import storage
+from const import MAX_PAGE_SIZE, SEARCH_LIMIT, TOKEN_CACHE
+from database import get_database
+from dgapi import AsyncDGAPI, DGAPIUnavailable
+from models.contract import ContractOverviewFields
 from models.credentials import Credentials
+from models.pagination import ContractSort, PageParams
+from storage import Storage
+from utils.cache import SingleFlight, TTLCache
+from utils import response_cache
+from utils.pagination import decode_cursor
+
+token_cache = TTLCache(TOKEN_CACHE["max_size"], TOKEN_CACHE["ttl"])
+token_validations = SingleFlight()
 
 
-class DGAPI(DGAPIBase):
+class DGAPI(AsyncDGAPI):
     """Return API object"""
 
     def __init__(self, request: Request):
         self.headers = dict(request.headers)
 
 
-class AWSS3:
-    """Logic for uploading and downloading AWS S3 files"""
-    BUCKET_NAME = AWS_S3_BUCKET_NAME
-    ROOT_FOLDER = AWS_S3_ROOT_FOLDER
-
-    def __init__(self):
-        self.client = boto3.client("s3")
-
-    def upload_fileobj(self, file: BinaryIO, object_name: str, ExtraArgs: dict | None = None) -> Any:
-        """Upload a file-like object to an S3 bucket
-
-        Args:
-            file (BinaryIO): The file-like object to upload
-            object_name (str): S3 object name
-
-        Returns:
-            Any: The S3 client response
-
-        Raises:
-            ClientError: The S3 service responded with an error
-        """
-        return self.client.upload_fileobj(
-            file, self.BUCKET_NAME, os.path.join(
-                self.ROOT_FOLDER, object_name), ExtraArgs=ExtraArgs)
+async def get_storage() -> Storage:
+    """Return the file storage backed by the process-wide client"""
+    return storage.get_storage()
 
-    def tag_object(self, object_name: str, tags: dict[str, str]) -> Any:
-        """Put key-value tags onto the specified object 
 
-        Args:
-            object_name (str): S3 object name
-            tags (dict[str, str]): List of key-value tags
+async def get_db() -> AsyncIOMotorDatabase:
+    """Return the MongoDB database backed by the process-wide connection pool"""
+    return get_database()
 
-        Returns:
-            Any: S3 client response
 
-        Raises:
-            ClientError: The S3 service responded with an error
-        """
-        return self.client.put_object_tagging(
-            Bucket=self.BUCKET_NAME,
-            Key=os.path.join(self.ROOT_FOLDER, object_name),
-            Tagging={
-                "TagSet": self.get_tag_set(tags)
-            }
-        )
-
-    def move_object(self, original_path: str, new_path: str) -> None:
-        original_path = os.path.join(self.ROOT_FOLDER, original_path)
-        # raises exception if file does not exist
-        self.client.head_object(Bucket=self.BUCKET_NAME, Key=original_path)
-        # copy the original file to the new location
-        copy_source = {
-            "Bucket": self.BUCKET_NAME,
-            "Key": original_path
-        }
-        new_path = os.path.join(self.ROOT_FOLDER, new_path)
-        self.client.copy_object(Bucket=self.BUCKET_NAME, CopySource=copy_source,
-                                Key=new_path)
-        # delete the original file
-        self.client.delete_object(Bucket=self.BUCKET_NAME,
-                                  Key=original_path)
-
-    def get_file(self, filepath: str) -> dict:
-        filepath = os.path.join(self.ROOT_FOLDER, filepath)
-        try:
-            response = self.client.head_object(
-                Bucket=self.BUCKET_NAME, Key=filepath)
-        except ClientError:
-            return {}
-        return {
-            "path": filepath,
-            "size": response["ContentLength"]
-        }
-
-    @classmethod
-    def get_tag_set(cls, tags: dict[str, str]) -> list[dict[str, str]]:
-        return [{"Key": key, "Value": value} for key, value in tags.items()]
-
-
-def get_db() -> Generator:
-    """Return the MongoDB database"""
-    with MongoCon() as db:
-        yield db
-
-
-def auth(
+async def auth(
     security_token: str = Header(),
     dgapi: DGAPI = Depends()
 ) -> Credentials:
@@ -121,8 +55,7 @@ def auth(
         )
     else:  # valid token
         # check if authorized
-        response = dgapi.get("valid_token")
-        if response.status_code != 200:
+        if not await validate_token(security_token, data.get("exp"), dgapi):
             raise HTTPException(status.HTTP_401_UNAUTHORIZED,
                                 detail="Unauthorized access")
         # return credentials if needed
@@ -135,8 +68,115 @@ def auth(
         )
 
 
+async def validate_token(security_token: str, exp: int | None, dgapi: DGAPI) -> bool:
+    """
+    Ask DGAPI whether the token is still valid, caching the answer by token hash.
+    Concurrent validations of the same token share one upstream call.
+    """
+    key = token_key(security_token)
+    valid = token_cache.get(key)
+    if valid is not None:
+        return valid
+    return await token_validations.do(key, lambda: _request_token_validation(key, exp, dgapi))
+
+
+def token_key(security_token: str) -> str:
+    return hashlib.sha256(security_token.encode()).hexdigest()
+
+
+def forget_token(security_token: str) -> None:
+    """Drop the cached validation of a token, e.g. once it is logged out"""
+    token_cache.delete(token_key(security_token))
+
+
+async def _request_token_validation(key: str, exp: int | None, dgapi: DGAPI) -> bool:
+    try:
+        response = await dgapi.get("valid_token")
+    except DGAPIUnavailable:
+        response = None
+    if response is None or response.status_code >= 500:
+        # DGAPI hiccup: serve the last known answer if it is still inside its stale window
+        valid = token_cache.get_stale(key)
+        if valid is None:
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Authentication service unavailable")
+        return valid
+    valid = response.status_code == 200
+    ttl = TOKEN_CACHE["ttl"] if valid else TOKEN_CACHE["negative_ttl"]
+    stale_ttl = TOKEN_CACHE["stale_ttl"] if valid else 0
+    if exp is not None:
+        # never trust the cached answer past the token's own expiration
+        remaining = exp - time.time() - TOKEN_CACHE["exp_margin"]
+        ttl = min(ttl, remaining)
+        stale_ttl = min(stale_ttl, remaining - ttl)
+    token_cache.set(key, valid, ttl, stale_ttl)
+    return valid
+
+
 async def group_parameters(
     current_group: str = Header(), current_dealer: str = Header()
 ) -> dict[str, str]:
     """Get the current group and dealer code from the request headers"""
     return {"group_code": current_group, "dealer_code": current_dealer}
+
+
+async def cached_response(request: Request, current_group: dict = Depends(group_parameters),
+                          db: AsyncIOMotorDatabase = Depends(get_db)) -> response_cache.CachedResponse:
+    """Look up the cached response of the request for the current group"""
+    return await response_cache.lookup(request, db, current_group)
+
+
+async def page_parameters(
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(None)
+) -> PageParams:
+    """Get the page size and the decoded cursor of a paginated listing"""
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return PageParams(limit=limit, after=after)
+
+
+async def contract_list_parameters(
+    page: PageParams = Depends(page_parameters),
+    sort: ContractSort = Query("_id"),
+    fields: str | None = Query(None, description="Comma separated list of fields to return")
+) -> PageParams:
+    """Get the pagination, sort and field selection of a contract listing"""
+    page.sort = sort
+    check_cursor_sort(page)
+    page.fields = parse_fields(fields)
+    return page
+
+
+async def search_parameters(
+    page: PageParams = Depends(page_parameters),
+    fields: str | None = Query(None, description="Comma separated list of fields to return")
+) -> PageParams:
+    """Get the pagination and field selection of a contract search, sorted by relevance"""
+    page.sort = "relevance"
+    check_cursor_sort(page)
+    page.limit = page.limit or SEARCH_LIMIT
+    page.fields = parse_fields(fields)
+    return page
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """Split and validate a comma separated list of ContractOverview fields"""
+    if not fields:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    allowed = set(ContractOverviewFields.__fields__) - {"id"}
+    invalid = [field for field in selected if field not in allowed]
+    if invalid:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid fields: {', '.join(invalid)}")
+    return selected
+
+
+def check_cursor_sort(page: PageParams) -> None:
+    """Reject cursors that were issued for a different sort order"""
+    if page.after and page.after["sort"] != page.sort:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            detail="Cursor does not match the sort order")
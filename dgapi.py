@@ -1,8 +1,138 @@
+import asyncio
+import random
+import time
 from typing import Literal
 
-import requests
+import httpx
 
-from const import APPLICATION_CODE, DGAPI_SERVER
+from const import APPLICATION_CODE, DGAPI_CLIENT, DGAPI_SERVER
+
+# headers that only make sense for the incoming connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "content-length",
+                      "transfer-encoding", "host", "upgrade"}
+RETRY_STATUS_CODES = {502, 503, 504}
+# errors raised before the request reached DGAPI, safe to retry for any method
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class DGAPIUnavailable(Exception):
+    """DGAPI could not be reached, or the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling DGAPI for reset_timeout seconds after failure_threshold
+    consecutive failures. Once the timeout elapses a single trial request is
+    let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def state(self) -> Literal["closed", "open", "half-open"]:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "half-open":
+            # let this request through as the trial, keep the others out
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Per-endpoint call count, error count and latency of DGAPI requests"""
+
+    def __init__(self):
+        self._endpoints: dict[str, dict] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        stats = self._endpoints.setdefault(
+            endpoint, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["errors"] += 0 if ok else 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            endpoint: {
+                "count": s["count"],
+                "errors": s["errors"],
+                "avg_ms": round(s["total"] / s["count"] * 1000, 2),
+                "max_ms": round(s["max"] * 1000, 2)
+            } for endpoint, s in self._endpoints.items()
+        }
+
+
+breaker = CircuitBreaker(
+    DGAPI_CLIENT["breaker_failures"], DGAPI_CLIENT["breaker_reset"])
+latency = LatencyStats()
+
+_client: httpx.Client | None = None
+_async_client: httpx.AsyncClient | None = None
+
+
+def _client_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(DGAPI_CLIENT["read_timeout"],
+                                 connect=DGAPI_CLIENT["connect_timeout"]),
+        "limits": httpx.Limits(
+            max_connections=DGAPI_CLIENT["max_connections"],
+            max_keepalive_connections=DGAPI_CLIENT["max_keepalive_connections"],
+            keepalive_expiry=DGAPI_CLIENT["keepalive_expiry"])
+    }
+
+
+def get_client() -> httpx.Client:
+    """Return the process-wide keep-alive client used by the sync DGAPI"""
+    global _client
+    if _client is None:
+        _client = httpx.Client(**_client_options())
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the process-wide keep-alive client used by the async DGAPI"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+async def close() -> None:
+    """Close both shared clients and their connection pools"""
+    global _client, _async_client
+    if _client is not None:
+        _client.close()
+        _client = None
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry attempt"""
+    return random.uniform(0, min(DGAPI_CLIENT["backoff_max"],
+                                 DGAPI_CLIENT["backoff"] * 2 ** attempt))
 
 
 class DGAPI(object):
@@ -13,15 +143,55 @@ class DGAPI(object):
     def __init__(self, headers: dict):
         self.headers = headers
 
-    def send_request(self, type_method: Literal["POST", "GET"], endpoint: str, body: dict | None, headers: dict) -> requests.Response:
-        if self.headers.get("content-length", False):
-            self.headers.pop("content-length")
+    def build_request(self, type_method: Literal["POST", "GET"], endpoint: str,
+                      body: dict | None, headers: dict) -> httpx.Request:
+        forwarded = {key: value for key, value in self.headers.items()
+                     if key.lower() not in HOP_BY_HOP_HEADERS}
         new_headers = {"application-code": APPLICATION_CODE,
-                       **self.headers, **headers}
-        endpoint = f"http://{self.server_address}/{endpoint}"
-        return requests.request(type_method, endpoint, json=body, headers=new_headers)
+                       **forwarded, **headers}
+        url = f"http://{self.server_address}/{endpoint}"
+        return httpx.Request(type_method, url, json=body, headers=new_headers)
+
+    def should_retry(self, type_method: str, attempt: int,
+                     response: httpx.Response | None = None,
+                     error: httpx.TransportError | None = None) -> bool:
+        """GET requests are retried on any transport error or gateway status, POST only on connect errors"""
+        if attempt >= DGAPI_CLIENT["retries"]:
+            return False
+        if error is not None:
+            return type_method == "GET" or isinstance(error, CONNECT_ERRORS)
+        return type_method == "GET" and response.status_code in RETRY_STATUS_CODES
+
+    def record_outcome(self, endpoint: str, started: float,
+                       response: httpx.Response | None) -> None:
+        ok = response is not None and response.status_code < 500
+        latency.record(endpoint, time.perf_counter() - started, ok)
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
 
-    def post(self, method: str, body: dict, headers: dict = {}) -> requests.Response:
+    def send_request(self, type_method: Literal["POST", "GET"], endpoint: str, body: dict | None, headers: dict) -> httpx.Response:
+        if not breaker.allow_request():
+            raise DGAPIUnavailable("DGAPI circuit breaker is open")
+        request = self.build_request(type_method, endpoint, body, headers)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = get_client().send(request)
+            except httpx.TransportError as ex:
+                self.record_outcome(endpoint, started, None)
+                if not self.should_retry(type_method, attempt, error=ex):
+                    raise DGAPIUnavailable(str(ex)) from ex
+            else:
+                self.record_outcome(endpoint, started, response)
+                if not self.should_retry(type_method, attempt, response=response):
+                    return response
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def post(self, method: str, body: dict, headers: dict = {}) -> httpx.Response:
         """
         Send POST request
 
@@ -32,7 +202,7 @@ class DGAPI(object):
         """
         return self.send_request('POST', method, body, headers)
 
-    def get(self, method: str, headers: dict = {}) -> requests.Response:
+    def get(self, method: str, headers: dict = {}) -> httpx.Response:
         """
         Send GET request
 
@@ -41,3 +211,48 @@ class DGAPI(object):
             headers (dict): Headers
         """
         return self.send_request('GET', method, None, headers)
+
+
+class AsyncDGAPI(DGAPI):
+    """DGAPI connection for async code, same interface as DGAPI but awaitable"""
+
+    async def send_request(self, type_method: Literal["POST", "GET"], endpoint: str, body: dict | None, headers: dict) -> httpx.Response:
+        if not breaker.allow_request():
+            raise DGAPIUnavailable("DGAPI circuit breaker is open")
+        request = self.build_request(type_method, endpoint, body, headers)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await get_async_client().send(request)
+            except httpx.TransportError as ex:
+                self.record_outcome(endpoint, started, None)
+                if not self.should_retry(type_method, attempt, error=ex):
+                    raise DGAPIUnavailable(str(ex)) from ex
+            else:
+                self.record_outcome(endpoint, started, response)
+                if not self.should_retry(type_method, attempt, response=response):
+                    return response
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def post(self, method: str, body: dict, headers: dict = {}) -> httpx.Response:
+        """
+        Send POST request
+
+        Parameters:
+            method (str): Endpoint request
+            body (dict): Body
+            headers (dict): Headers
+        """
+        return await self.send_request('POST', method, body, headers)
+
+    async def get(self, method: str, headers: dict = {}) -> httpx.Response:
+        """
+        Send GET request
+
+        Parameters:
+            method (str): Endpoint request
+            headers (dict): Headers
+        """
+        return await self.send_request('GET', method, None, headers)
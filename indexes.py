@@ -0,0 +1,77 @@
+"""
+Catalogue of the MongoDB indexes the application relies on. ensure_indexes
+creates whatever is missing and is safe to run on every startup.
+"""
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+GROUP = [("group_code", ASCENDING), ("dealer_code", ASCENDING)]
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "categories": [
+        IndexModel(GROUP + [("name", ASCENDING)], unique=True),
+    ],
+    "responsibles": [
+        IndexModel(GROUP + [("name", ASCENDING)], unique=True),
+    ],
+    "contract_fields": [
+        IndexModel(GROUP + [("field_code", ASCENDING)], unique=True),
+    ],
+    "contracts": [
+        # listings paged by _id or by due_date
+        IndexModel(GROUP + [("_id", ASCENDING)]),
+        IndexModel(GROUP + [("due_date", ASCENDING), ("_id", ASCENDING)]),
+        # alerts: active contracts due before a date, closest first
+        IndexModel(GROUP + [("contract_status", ASCENDING), ("due_date", ASCENDING)]),
+        # monthly and annual dashboards: type and status, ranged on effective_date
+        IndexModel(GROUP + [("type", ASCENDING), ("contract_status", ASCENDING),
+                            ("effective_date", ASCENDING)]),
+        # oldest effective date and the inactive totals
+        IndexModel(GROUP + [("contract_status", ASCENDING), ("effective_date", ASCENDING)]),
+        # contractor name search, anchored prefixes of the name's words
+        IndexModel(GROUP + [("search_tokens", ASCENDING)]),
+        # due date roll-forward: overdue active contracts of every group
+        IndexModel([("contract_status", ASCENDING), ("due_date", ASCENDING), ("_id", ASCENDING)]),
+        # fan-out of category and responsible renames
+        IndexModel([("category_id", ASCENDING)]),
+        IndexModel([("responsible_id", ASCENDING)]),
+    ],
+    "dashboard_rollups": [
+        # one document per type and month, plus the group document (type and month None)
+        IndexModel(GROUP + [("type", ASCENDING), ("month", ASCENDING)], unique=True),
+    ],
+    "data_versions": [
+        IndexModel(GROUP, unique=True),
+    ],
+    "alert_digests": [
+        IndexModel(GROUP, unique=True),
+    ],
+    "job_runs": [
+        IndexModel([("job", ASCENDING), ("started_at", ASCENDING)]),
+    ],
+    "files": [
+        IndexModel([("path", ASCENDING)], unique=True),
+        IndexModel([("contract_id", ASCENDING)]),
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> dict[str, list[str]]:
+    """
+    Create every index of the catalogue that does not exist yet. A collection
+    whose indexes can not be built (e.g. duplicated data under a unique index)
+    is reported and skipped instead of aborting the others.
+    """
+    report = {}
+    for collection, models in INDEXES.items():
+        try:
+            report[collection] = await db[collection].create_indexes(models)
+        except OperationFailure as ex:
+            logger.warning("Could not create the %s indexes: %s", collection, ex)
+            report[collection] = [f"error: {ex}"]
+    return report
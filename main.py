@@ -1,9 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from pymongo.errors import PyMongoError
 
+import database
+import dgapi
+import indexes
+import storage
 from routes import (alerts, authentication, categories, contract_fields,
-                    contracts, dashboard, files, responsibles)
+                    contracts, dashboard, diagnostics, files, local_storage,
+                    responsibles)
+from const import ALERT_DIGEST, ROLL_FORWARD, STORAGE
+from utils import attachments, digests, references, response_cache, scheduler
+from utils.roll_forward import roll_forward
+from utils.pagination import NEXT_CURSOR_HEADER
 
 app = FastAPI()
 
@@ -13,8 +23,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+
+@app.on_event("startup")
+async def connect_database() -> None:
+    """Open the shared MongoDB connection pool before the routers start"""
+    database.connect()
+    db = database.get_database()
+    try:
+        await indexes.ensure_indexes(db)
+    except PyMongoError:
+        pass  # the server may be unreachable at boot, indexes can be built later with the CLI
+    references.start_watcher(db)
+    if ROLL_FORWARD["enabled"]:
+        scheduler.start(db, "roll_forward", lambda db: roll_forward(db, ROLL_FORWARD["batch_size"]),
+                        ROLL_FORWARD["interval"], ROLL_FORWARD["lease"], once_per_interval=True)
+    if ALERT_DIGEST["enabled"]:
+        response_cache.add_change_listener(digests.schedule_refresh)
+        scheduler.start(db, "alert_digests", digests.refresh_stale_digests,
+                        ALERT_DIGEST["interval"], ALERT_DIGEST["lease"], once_per_interval=True)
+
+
+@app.on_event("shutdown")
+async def close_database() -> None:
+    """Stop the background tasks and release the shared MongoDB, DGAPI and storage connection pools"""
+    await references.stop_watcher()
+    await scheduler.stop()
+    await digests.cancel_refreshes()
+    database.close()
+    await dgapi.close()
+    attachments.executor.shutdown()
+    storage.close()
+
+
 app.include_router(authentication.router)
 app.include_router(responsibles.router)
 app.include_router(categories.router)
@@ -23,6 +66,10 @@ app.include_router(contracts.router)
 app.include_router(files.router)
 app.include_router(dashboard.router)
 app.include_router(alerts.router)
+app.include_router(diagnostics.router)
+if STORAGE["backend"] == "local":
+    # serves the presigned URLs of the local storage
+    app.include_router(local_storage.router)
 
 
 @ app.get("/", tags=["root"])
@@ -35,6 +35,21 @@ class ContractOverview(ContractBase, MongoModel):
     responsible: str
 
 
+class ContractOverviewFields(MongoModel):
+    """ContractOverview with optional fields, used when a subset of fields is requested"""
+    contractor_name: str | None
+    periodicity: ContractPeriodicity | None
+    type: ContractType | None
+    value: float | None
+    effective_date: datetime | None
+    contract_status: ContractStatus | None
+    category_id: PyObjectId | None
+    responsible_id: PyObjectId | None
+    due_date: datetime | None
+    category: str | None
+    responsible: str | None
+
+
 class ContractDetails(ContractBase, MongoModel):
     due_date: datetime
     category: str
@@ -47,3 +62,50 @@ class AlertsContractOverview(ContractBase, MongoModel):
     category: str
     responsible: str
     days_until_due_date: int
+
+
+class ContractImportError(BaseModel):
+    row: int
+    errors: list[str]
+
+
+class ContractImportReport(BaseModel):
+    rows: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: list[ContractImportError] = []
+    seconds: float = 0.0
+    rows_per_second: float = 0.0
+
+
+class ContractBulkFilter(BaseModel):
+    """Contracts of the current group targeted by a bulk operation, every given criterion must match"""
+    ids: list[PyObjectId] | None
+    contract_status: ContractStatus | None
+    type: ContractType | None
+    periodicity: ContractPeriodicity | None
+    category_id: PyObjectId | None
+    responsible_id: PyObjectId | None
+
+
+class ContractBulkChanges(BaseModel):
+    contract_status: ContractStatus | None
+    category_id: PyObjectId | None
+    responsible_id: PyObjectId | None
+
+
+class ContractBulkUpdate(BaseModel):
+    filter: ContractBulkFilter
+    changes: ContractBulkChanges
+    dry_run: bool = False
+
+
+class ContractBulkDelete(BaseModel):
+    filter: ContractBulkFilter
+    dry_run: bool = False
+
+
+class ContractBulkResult(BaseModel):
+    matched: int = 0
+    modified: int = 0
+    dry_run: bool = False
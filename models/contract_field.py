@@ -6,7 +6,8 @@ from pydantic import BaseModel
 from models.mongo import MongoModel
 
 BlockedFields = {"contractor_name", "periodicity", "type", "value", "effective_date",
-                 "contract_status", "category_id", "responsible_id", "category", "responsible", "extra_fields", "path", "due_date"}
+                 "contract_status", "category_id", "responsible_id", "category", "responsible", "extra_fields", "path", "paths", "due_date",
+                 "search_key", "search_tokens"}
 FieldStatus = Literal["required", "additional"]
 FieldType = Literal["text", "email", "phone",
                     "currency", "number", "toggle", "date"]
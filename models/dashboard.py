@@ -32,6 +32,7 @@ class ValueRangeGroup(BaseModel):
 
 class AnnualDashboardOut(BaseModel):
     by_month: list[AnnualDashboardGroup] = []
+    by_year: list[AnnualDashboardGroup] = []
     by_periodicity: list[AnnualDashboardGroup] = []
     by_value_range_qty: list[ValueRangeGroup] = []
 
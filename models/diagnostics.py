@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class QueryPlan(BaseModel):
+    """Summary of the winning plan of an explained query"""
+    name: str
+    collscan: bool
+    stages: list[str] = []
+    indexes: list[str] = []
+
+
+class IndexDiagnostics(BaseModel):
+    plans: list[QueryPlan] = []
+    collscans: list[str] = []
@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+from typing import Literal
+
+ContractSort = Literal["_id", "-_id", "due_date", "-due_date"]
+SearchSort = Literal["relevance"]
+
+
+@dataclass
+class PageParams:
+    """Keyset pagination options shared by the contract listings"""
+    limit: int | None = None
+    after: dict | None = None  # decoded cursor, the sort key of the last row served
+    sort: ContractSort | SearchSort = "_id"
+    fields: list[str] | None = None
@@ -1,32 +1,43 @@
-from datetime import datetime, timedelta
-from operator import itemgetter
+from datetime import datetime
 
-from dateutil.relativedelta import relativedelta
-from deps import auth, get_db, group_parameters
+from const import MAX_ALERT_DAYS
+from deps import (auth, cached_response, check_cursor_sort, get_db,
+                  group_parameters, page_parameters)
 from fastapi import APIRouter, Depends, Query
 from models.contract import AlertsContractOverview
-from pymongo.database import Database
-from utils.functions import retrieve_contracts
+from models.pagination import PageParams
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from utils import digests
+from utils.functions import aggregate_page, alerts_pipeline
+from utils.pagination import NEXT_CURSOR_HEADER
+from utils.response_cache import CachedResponse
 
 router = APIRouter(prefix="/alerts",
                    tags=["alerts"], dependencies=[Depends(auth)])
 
 
 @router.get("/", response_model=list[AlertsContractOverview])
-def get_alerts(days_filter: int = Query(gt=0),
-               current_group: dict = Depends(group_parameters),
-               db: Database = Depends(get_db)):
-    today_delta = datetime.today() + relativedelta(days=days_filter+1)
-    contracts = retrieve_contracts(db, {"$and": [
-        current_group,
-        {"due_date": {"$lt": today_delta}},
-        {"contract_status": "active"}
-    ]})
-
-    l = []
-    for contract in contracts:
-        delta = contract.due_date - datetime.today()
-        dict_contract = contract.dict()
-        dict_contract["days_until_due_date"] = delta.days
-        l.append(dict_contract)
-    return sorted(l, key=itemgetter("days_until_due_date"))
+async def get_alerts(days_filter: int = Query(gt=0, le=MAX_ALERT_DAYS),
+                     current_group: dict = Depends(group_parameters),
+                     page: PageParams = Depends(page_parameters),
+                     cache: CachedResponse = Depends(cached_response),
+                     db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Active contracts due within days_filter days, closest due date first.
+    Served from the group's alert digest when it is current and covers
+    days_filter, otherwise computed by the database.
+    """
+    # closest due date first is also the order of days_until_due_date
+    page.sort = "due_date"
+    check_cursor_sort(page)
+    if cache.response:
+        return cache.response
+    today = datetime.today()
+    digest_page = await digests.read_alerts(db, current_group, today, days_filter, page)
+    if digest_page is not None:
+        contracts, next_cursor = digest_page
+    else:
+        contracts, next_cursor = await aggregate_page(
+            db, alerts_pipeline(current_group, today, days_filter, page), page)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return await cache.store(contracts, list[AlertsContractOverview], headers)
@@ -1,6 +1,7 @@
 from const import APPLICATION_CODE
-from deps import DGAPI, auth
-from fastapi import APIRouter, Depends
+from deps import DGAPI, auth, forget_token
+from dgapi import DGAPIUnavailable
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from fastapi.responses import JSONResponse
 from utils import responses
 
@@ -10,22 +11,33 @@ router = APIRouter(tags=["authentication"])
 @router.get(
     "/one_authentication"
 )
-def one_authentication(dgapi: DGAPI = Depends()):
-    response = dgapi.post(
-        "one_authentication",
-        {"application_code": APPLICATION_CODE},
-        {'content-type': "application/json"}
-
-    )
+async def one_authentication(dgapi: DGAPI = Depends()):
+    try:
+        response = await dgapi.post(
+            "one_authentication",
+            {"application_code": APPLICATION_CODE},
+            {'content-type': "application/json"}
+
+        )
+    except DGAPIUnavailable:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Authentication service unavailable")
     return JSONResponse(status_code=response.status_code, content=response.json())
 
 
 @router.get("/logout")
-def logout(dgapi: DGAPI = Depends()):
-    response = dgapi.get("logout")
+async def logout(security_token: str | None = Header(None), dgapi: DGAPI = Depends()):
+    try:
+        response = await dgapi.get("logout")
+    except DGAPIUnavailable:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Authentication service unavailable")
+    if response.is_success and security_token:
+        # the token must not stay valid in the validation cache
+        forget_token(security_token)
     return JSONResponse(status_code=response.status_code, content=response.json())
 
 
 @router.get("/is_authorized", dependencies=[Depends(auth)])
-def is_authorized():
+async def is_authorized():
     return responses.success_ok()
@@ -1,66 +1,56 @@
-from database import MongoCon
 from deps import auth, get_db, group_parameters
 from fastapi import APIRouter, Depends, HTTPException, status
 from models.category import CategoryIn, CategoryOut
 from models.mongo import PyObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo import ReturnDocument
-from pymongo.database import Database
 from pymongo.errors import DuplicateKeyError
+from utils import references, response_cache
 
 router = APIRouter(
     prefix="/categories", tags=["categories"], dependencies=[Depends(auth)]
 )
 
 
-@router.on_event("startup")
-def router_setup() -> None:
-    """Setup the unique index for the Mongo database"""
-    try:
-        with MongoCon() as db:  # can not use dependencies on event handlers
-            db.categories.create_index(
-                [("group_code", 1), ("dealer_code", 1), ("name", 1)], unique=True
-            )
-    except:
-        pass
-
-
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=CategoryOut)
-def create_category(
+async def create_category(
     category: CategoryIn,
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Create a new category for the current group"""
     category_data = {**current_group, **category.dict()}
     try:
-        new_category = db.categories.insert_one(category_data)
+        new_category = await db.categories.insert_one(category_data)
     except DuplicateKeyError:
         # if the insertion violates the predefined index
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             detail=f"Duplicate na for {current_group['dealer_code']}")
-    created_category = db.categories.find_one(
+    references.invalidate("categories", current_group)
+    await response_cache.mark_group_changed(db, current_group)
+    created_category = await db.categories.find_one(
         {"_id": new_category.inserted_id})
     return created_category
 
 
 @router.get("/", response_model=list[CategoryOut])
-def list_categories(
+async def list_categories(
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get a list of all categories for the specified group"""
     categories = db.categories.find(current_group)
-    return list(categories)
+    return await categories.to_list(None)
 
 
 @router.put("/{id}", response_model=CategoryOut)
-def update_category(
+async def update_category(
     id: PyObjectId,
     category: CategoryIn,
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     try:
-        updated_category = db.categories.find_one_and_update(
+        updated_category = await db.categories.find_one_and_update(
             {"_id": id}, {"$set": category.dict()}, return_document=ReturnDocument.AFTER
         )
     except DuplicateKeyError:
@@ -69,4 +59,10 @@ def update_category(
     if updated_category is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND,
                             detail="Category not found")
+    references.invalidate("categories", updated_category)
+    # contracts keep a copy of the name, propagate the rename
+    await db.contracts.update_many(
+        {"category_id": id}, {"$set": {"category": updated_category["name"]}}
+    )
+    await response_cache.mark_group_changed(db, updated_category)
     return updated_category
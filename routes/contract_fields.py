@@ -1,40 +1,27 @@
 import re
 
-from database import MongoCon
 from deps import auth, get_db, group_parameters
 from fastapi import APIRouter, Depends, HTTPException, status
 from models.contract_field import (BlockedFields, ContractFieldIn,
                                    ContractFieldOut, ContractFieldUpdate)
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo import ReturnDocument
-from pymongo.database import Database
 from pymongo.errors import BulkWriteError, DuplicateKeyError
-from utils import responses
+from utils import references, responses, rollups
 
 router = APIRouter(prefix="/contract_fields",
                    tags=["contract_fields"], dependencies=[Depends(auth)])
 
 
-@router.on_event("startup")
-def router_setup() -> None:
-    """Setup the unique index for the Mongo database"""
-    try:
-        with MongoCon() as db:  # can not use dependencies on event handlers
-            db.contract_fields.create_index(
-                [("group_code", 1), ("dealer_code", 1), ("field_code", 1)], unique=True
-            )
-    except:
-        pass
-
-
 @router.post(
     "/",
     status_code=status.HTTP_201_CREATED,
     response_model=ContractFieldOut
 )
-def create_contract_field(
+async def create_contract_field(
     contract_field: ContractFieldIn,
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Create a new contract field for a given group"""
     contract_field_data = {
@@ -46,27 +33,28 @@ def create_contract_field(
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             detail="Blocked field_code")
     try:
-        new_contract_field = db.contract_fields.insert_one(contract_field_data)
+        new_contract_field = await db.contract_fields.insert_one(contract_field_data)
     except DuplicateKeyError:
         # if the insertion violates the predefined index
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST,
             detail=f"Duplicate code for {current_group['dealer_code']}"
         )
-    created_contract_field = db.contract_fields.find_one(
+    references.invalidate("contract_fields", current_group)
+    created_contract_field = await db.contract_fields.find_one(
         {"_id": new_contract_field.inserted_id}
     )
     return created_contract_field
 
 
 @router.get("/", response_model=list[ContractFieldOut])
-def list_contract_fields(
+async def list_contract_fields(
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get all the contract fields for a given group"""
     contract_fields = db.contract_fields.find(current_group)
-    return list(contract_fields)
+    return await contract_fields.to_list(None)
 
 
 # @router.get("/global_fields", response_model=list[GlobalFieldOut])
@@ -77,36 +65,42 @@ def list_contract_fields(
 
 
 @router.post("/{field_code}", response_model=dict)
-def update_field_status(
+async def update_field_status(
     field_code: str,
     field_update: ContractFieldUpdate,
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Update the field_status of a given contract field"""
     query = {**current_group, "field_code": field_code}
-    contract_field = db.contract_fields.find_one_and_update(
+    contract_field = await db.contract_fields.find_one_and_update(
         query, {"$set": field_update.dict()}, return_document=ReturnDocument.AFTER
     )
     if contract_field is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Field does not exist")
+    references.invalidate("contract_fields", current_group)
     return responses.success_ok()
 
 
 @router.get("/init_group_fields", response_model=dict)
-def init_group_fields(
+async def init_group_fields(
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Initializes the contract fields of a new group at the moment of installation"""
     global_fields = db.global_fields.find(
         {}, {"_id": 0, **current_group, "field_label": 1, "field_code": 1, "field_type": 1, "field_status": "additional"})
     try:
-        _ = db.contract_fields.insert_many(
-            list(global_fields))
+        _ = await db.contract_fields.insert_many(
+            await global_fields.to_list(None))
     except BulkWriteError:
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             "This group has already been initialized")
+    finally:
+        references.invalidate("contract_fields", current_group)
+    # a new group starts with empty, already built, dashboard rollups
+    if not await db.contracts.find_one(current_group, {"_id": 1}):
+        await rollups.mark_built(db, current_group)
     return responses.success_ok()
 
 
@@ -1,11 +1,32 @@
-from deps import auth, get_db, group_parameters
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
-from models.contract import ContractDetails, ContractIn, ContractOverview
+import csv
+import time
+
+from const import (EXPORT_BATCH_SIZE, IMPORT_BATCH_SIZE, MAX_EXPORT_BATCH_SIZE,
+                   MAX_IMPORT_ERRORS, MAX_PAGE_SIZE)
+from deps import (auth, contract_list_parameters, get_db, group_parameters,
+                  search_parameters)
+from fastapi import (APIRouter, Depends, HTTPException, Query, Response,
+                     UploadFile, status)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from models.contract import (ContractBulkDelete, ContractBulkResult,
+                             ContractBulkUpdate, ContractDetails,
+                             ContractImportReport, ContractIn, ContractOverview,
+                             ContractOverviewFields)
 from models.mongo import PyObjectId
-from pymongo.database import Database
-from utils import responses
-from utils.functions import build_contract_data, retrieve_contracts
+from models.pagination import PageParams
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+from utils import references, response_cache, responses, rollups
+from utils.bulk import bulk_delete, bulk_query, bulk_update
+from utils.export import EXPORT_COLUMNS, MEDIA_TYPES, ExportFormat, stream_rows
+from utils.functions import (aggregate_page, build_contract_data,
+                             contracts_pipeline, retrieve_contract_details,
+                             retrieve_contract_page, retrieve_contracts,
+                             search_pipeline)
+from utils.imports import ContractImporter, build_batch, read_rows
+from utils.search import normalize
+from utils.pagination import NEXT_CURSOR_HEADER
 
 router = APIRouter(
     prefix="/contracts", tags=["contracts"], dependencies=[Depends(auth)]
@@ -13,181 +34,240 @@ router = APIRouter(
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=ContractOverview)
-def create_contract(
+async def create_contract(
     contract: ContractIn,
     current_group=Depends(group_parameters),
-    db: Database = Depends(get_db),
+    db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     # verify if the category_id and responsible_id exists
-    category = db.categories.find_one(
-        {"_id": contract.category_id}, {"_id": 1})
+    category = (await references.get_categories(db, current_group)).get(contract.category_id)
     if category is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             "Invalid category")
-    responsible = db.responsibles.find_one(
-        {"_id": contract.responsible_id}, {"_id": 1})
+    responsible = (await references.get_responsibles(db, current_group)).get(contract.responsible_id)
     if responsible is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             "Invalid responsible")
 
-    contract_data = build_contract_data(contract, current_group)
-    new_contract = db.contracts.insert_one(contract_data)
-    new_contract = retrieve_contracts(db, {"_id": new_contract.inserted_id})
+    contract_data = build_contract_data(contract, current_group, {
+        "category": category["name"],
+        "responsible": responsible["name"]
+    })
+    new_contract = await db.contracts.insert_one(contract_data)
+    await rollups.apply_change(db, new=contract_data)
+    await response_cache.mark_group_changed(db, current_group)
+    new_contract = await retrieve_contracts(db, {"_id": new_contract.inserted_id})
     return new_contract[0]
 
 
-@router.get("/", response_model=list[ContractOverview])
-def list_contracts(current_group=Depends(group_parameters), db: Database = Depends(get_db)):
-    return retrieve_contracts(db, current_group)
+@router.get("/", response_model=list[ContractOverviewFields], response_model_exclude_unset=True)
+async def list_contracts(response: Response, current_group=Depends(group_parameters),
+                         page: PageParams = Depends(contract_list_parameters),
+                         db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    List the contracts of the current group. When a limit is given and more
+    rows remain, the cursor of the next page is returned in the X-Next-Cursor header.
+    """
+    contracts, next_cursor = await retrieve_contract_page(db, current_group, page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return contracts
 
 
-@router.get("/search/{query}", response_model=list[ContractOverview])
-def search_contract(query: str, db: Database = Depends(get_db), current_group=Depends(group_parameters)):
-    return retrieve_contracts(db, {
-        '$and': [
-            {**current_group},
-            {'contractor_name': {'$regex': query, "$options": "i"}}
-        ]
-    })
+@router.get("/search/{query}", response_model=list[ContractOverviewFields], response_model_exclude_unset=True)
+async def search_contract(query: str, response: Response, db: AsyncIOMotorDatabase = Depends(get_db),
+                          current_group=Depends(group_parameters),
+                          page: PageParams = Depends(search_parameters)):
+    """
+    Search contracts by contractor name. Every word of the query must be the
+    start of a word of the name (case and accents are ignored). Results are
+    ordered by relevance and limited to SEARCH_LIMIT rows unless a limit is given.
+    """
+    if not normalize(query):
+        return []
+    contracts, next_cursor = await aggregate_page(
+        db, search_pipeline(current_group, query, page), page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return contracts
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contracts(format: ExportFormat = Query("ndjson"),
+                           batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+                           current_group=Depends(group_parameters),
+                           db: AsyncIOMotorDatabase = Depends(get_db)) -> StreamingResponse:
+    """
+    Stream every contract of the current group as NDJSON or CSV straight from
+    the database cursor. The group's contract fields are flattened into columns.
+    """
+    contract_fields = db.contract_fields.find(current_group, {"field_code": 1})
+    extra_fields = [field["field_code"] async for field in contract_fields]
+    cursor = db.contracts.aggregate(
+        contracts_pipeline(current_group, extra_fields=extra_fields), batchSize=batch_size)
+    return StreamingResponse(
+        stream_rows(cursor, EXPORT_COLUMNS + extra_fields, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="contracts.{format}"'}
+    )
+
+
+@router.post("/import", response_model=ContractImportReport)
+async def import_contracts(file: UploadFile, format: ExportFormat | None = Query(None),
+                           current_group=Depends(group_parameters),
+                           db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Create the contracts of a CSV or NDJSON upload (by default guessed from
+    the file extension). The columns are those of ContractIn, category and
+    responsible can be given by name instead of id, and columns named after
+    a contract field of the group become extra fields, so an export can be
+    imported as is. Rows are read and validated in batches of
+    IMPORT_BATCH_SIZE, each inserted with a single unordered insert_many;
+    invalid rows are skipped and reported by row number.
+    """
+    if format is None:
+        format = "csv" if (file.filename or "").lower().endswith(".csv") else "ndjson"
+    importer = ContractImporter(
+        current_group,
+        await references.get_categories(db, current_group),
+        await references.get_responsibles(db, current_group),
+        await references.get_contract_fields(db, current_group)
+    )
+    rows = read_rows(file.file, format)
+    report = {"rows": 0, "inserted": 0, "failed": 0, "errors": []}
+
+    def fail(errors: list[dict]) -> None:
+        report["failed"] += len(errors)
+        report["errors"].extend(errors[:MAX_IMPORT_ERRORS - len(report["errors"])])
+
+    started = time.monotonic()
+    while True:
+        try:
+            documents, errors, count = await run_in_threadpool(
+                build_batch, rows, importer, report["rows"] + 1, IMPORT_BATCH_SIZE)
+        except (UnicodeDecodeError, csv.Error) as ex:
+            fail([{"row": report["rows"] + 1, "errors": [f"Could not read the file: {ex}"]}])
+            break
+        if count == 0:
+            break
+        report["rows"] += count
+        fail(errors)
+        if not documents:
+            continue
+        numbers = [number for number, _ in documents]
+        documents = [document for _, document in documents]
+        failed = {}
+        try:
+            await db.contracts.insert_many(documents, ordered=False)
+        except BulkWriteError as ex:
+            failed = {error["index"]: error["errmsg"] for error in ex.details["writeErrors"]}
+            fail([{"row": numbers[index], "errors": [message]} for index, message in failed.items()])
+        inserted = [document for index, document in enumerate(documents) if index not in failed]
+        report["inserted"] += len(inserted)
+        await rollups.apply_changes(db, [(None, document) for document in inserted])
+
+    if report["inserted"]:
+        await response_cache.mark_group_changed(db, current_group)
+    report["seconds"] = round(time.monotonic() - started, 3)
+    report["rows_per_second"] = round(report["rows"] / report["seconds"], 1) if report["seconds"] else 0.0
+    return report
+
+
+@router.post("/bulk/update", response_model=ContractBulkResult)
+async def bulk_update_contracts(operation: ContractBulkUpdate, current_group=Depends(group_parameters),
+                                db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Change the status, category or responsible of every contract of the
+    group matching the filter. With dry_run nothing is written and the
+    contracts that would be modified are counted.
+    """
+    changes = operation.changes.dict(exclude_none=True)
+    if not changes:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "No changes given")
+    if not operation.filter.dict(exclude_none=True):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Empty filter")
+    if "category_id" in changes:
+        category = (await references.get_categories(db, current_group)).get(changes["category_id"])
+        if category is None:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid category")
+        changes["category"] = category["name"]
+    if "responsible_id" in changes:
+        responsible = (await references.get_responsibles(db, current_group)).get(changes["responsible_id"])
+        if responsible is None:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid responsible")
+        changes["responsible"] = responsible["name"]
+    result = await bulk_update(db, bulk_query(current_group, operation.filter), changes, operation.dry_run)
+    if result["modified"] and not operation.dry_run:
+        await response_cache.mark_group_changed(db, current_group)
+    return result
+
+
+@router.post("/bulk/delete", response_model=ContractBulkResult)
+async def bulk_delete_contracts(operation: ContractBulkDelete, current_group=Depends(group_parameters),
+                                db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Delete every contract of the group matching the filter, modified being
+    the deleted count. With dry_run nothing is deleted.
+    """
+    if not operation.filter.dict(exclude_none=True):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Empty filter")
+    result = await bulk_delete(db, bulk_query(current_group, operation.filter), operation.dry_run)
+    if result["modified"] and not operation.dry_run:
+        await response_cache.mark_group_changed(db, current_group)
+    return result
+
+
+@router.get("/details", response_model=list[ContractDetails])
+async def get_contracts_details(ids: list[PyObjectId] = Query(..., max_items=MAX_PAGE_SIZE),
+                                current_group=Depends(group_parameters),
+                                db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Details of several contracts, in the order of ids. Unknown ids are skipped."""
+    return await retrieve_contract_details(db, current_group, ids)
 
 
 @router.get("/{id}", response_model=ContractDetails)
-def get_contract_details(id: PyObjectId, db: Database = Depends(get_db)):
-    pipeline = [
-        {
-            '$match': {
-                '_id': id
-            }
-        }, {
-            '$project': {
-                'contractor_name': 0,
-                'category_id': 0,
-                'periodicity': 0,
-                'type': 0,
-                'value': 0,
-                'effective_date': 0,
-                'responsible_id': 0,
-                'contract_status': 0
-            }
-        }, {
-            '$project': {
-                'group_code': 1,
-                'dealer_code': 1,
-                'extra_fields': {
-                    '$filter': {
-                        'input': {
-                            '$objectToArray': '$$ROOT'
-                        },
-                        'cond': {
-                            '$not': {
-                                '$in': [
-                                    '$$this.k', [
-                                        '_id', 'dealer_code', 'group_code'
-                                    ]
-                                ]
-                            }
-                        }
-                    }
-                }
-            }
-        }, {
-            '$unwind': {
-                'path': '$extra_fields'
-            }
-        }, {
-            '$lookup': {
-                'from': 'contract_fields',
-                'let': {
-                    'group_code': '$group_code',
-                    'dealer_code': '$dealer_code',
-                    'key': '$extra_fields.k',
-                    'value': '$extra_fields.v'
-                },
-                'pipeline': [
-                    {
-                        '$match': {
-                            '$expr': {
-                                '$and': [
-                                    {
-                                        '$eq': [
-                                            '$field_code', '$$key'
-                                        ]
-                                    }, {
-                                        '$eq': [
-                                            '$group_code', '$$group_code'
-                                        ]
-                                    }, {
-                                        '$eq': [
-                                            '$dealer_code', '$$dealer_code'
-                                        ]
-                                    }
-                                ]
-                            }
-                        }
-                    }, {
-                        '$project': {
-                            '_id': 0,
-                            'group_code': 0,
-                            'dealer_code': 0
-                        }
-                    }, {
-                        '$addFields': {
-                            'field_value': '$$value'
-                        }
-                    }
-                ],
-                'as': 'field_objs'
-            }
-        }, {
-            '$unwind': {
-                'path': '$field_objs'
-            }
-        }, {
-            '$group': {
-                '_id': '$_id',
-                'extra_fields': {
-                    '$push': '$field_objs'
-                }
-            }
-        }
-    ]
-    result = db.contracts.aggregate(pipeline)
-    if not result._has_next():
+async def get_contract_details(id: PyObjectId, current_group=Depends(group_parameters),
+                               db: AsyncIOMotorDatabase = Depends(get_db)):
+    contracts = await retrieve_contract_details(db, current_group, [id])
+    if not contracts:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Contract not found")
-
-    extra_fields = next(result)["extra_fields"]
-    contract_overview = retrieve_contracts(db, {"_id": id})[0]
-    return ContractDetails(**contract_overview.dict(), extra_fields=extra_fields)
+    return contracts[0]
 
 
 @router.put("/{id}", response_model=ContractOverview)
-def update_contract(id: PyObjectId, contract: ContractIn, db: Database = Depends(get_db)):
+async def update_contract(id: PyObjectId, contract: ContractIn, current_group=Depends(group_parameters),
+                          db: AsyncIOMotorDatabase = Depends(get_db)):
     # verify if the category_id and responsible_id exists
-    category = db.categories.find_one(
-        {"_id": contract.category_id}, {"_id": 1})
+    category = (await references.get_categories(db, current_group)).get(contract.category_id)
     if category is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             "Invalid category")
-    responsible = db.responsibles.find_one(
-        {"_id": contract.responsible_id}, {"_id": 1})
+    responsible = (await references.get_responsibles(db, current_group)).get(contract.responsible_id)
     if responsible is None:
         raise HTTPException(status.HTTP_400_BAD_REQUEST,
                             "Invalid responsible")
 
-    updated_contract_data = build_contract_data(contract)
-    updated_contract = db.contracts.find_one_and_update({"_id": id}, {
+    updated_contract_data = build_contract_data(contract, references={
+        "category": category["name"],
+        "responsible": responsible["name"]
+    })
+    updated_contract = await db.contracts.find_one_and_update({"_id": id, **current_group}, {
         "$set": updated_contract_data
     })
     if not updated_contract:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Contract not found")
+    await rollups.apply_change(db, updated_contract, {**updated_contract, **updated_contract_data})
+    await response_cache.mark_group_changed(db, current_group)
 
-    return retrieve_contracts(db, {"_id": id})[0]
+    return (await retrieve_contracts(db, {"_id": id}))[0]
 
 
 @router.delete("/{id}")
-def delete_contract(id: PyObjectId, db: Database = Depends(get_db)) -> JSONResponse:
+async def delete_contract(id: PyObjectId, db: AsyncIOMotorDatabase = Depends(get_db)) -> JSONResponse:
     """Delete a contract using its id"""
-    result = db.contracts.delete_one({"_id": id})
-    if result.deleted_count == 0:
+    deleted_contract = await db.contracts.find_one_and_delete({"_id": id})
+    if not deleted_contract:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Contract not found")
+    await rollups.apply_change(db, old=deleted_contract)
+    await response_cache.mark_group_changed(db, deleted_contract)
     return responses.success_ok()
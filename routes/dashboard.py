@@ -1,277 +1,141 @@
-import heapq
-import math
 from datetime import datetime
-from operator import itemgetter
-from turtle import update
+from typing import get_args
 
 from dateutil.relativedelta import relativedelta
-from deps import auth, get_db, group_parameters
+from const import MAX_DASHBOARD_YEARS, VALUE_RANGE_BOUNDS
+from deps import auth, cached_response, get_db, group_parameters
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from models.contract import ContractType
+from models.contract import ContractPeriodicity, ContractType
 from models.dashboard import (AnnualDashboardOut, MonthlyDashboardOut,
                               OldestDateOut)
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from utils import rollups
+from utils.response_cache import CachedResponse
+from utils.dashboard import (annual_pipeline, monthly_pipeline, oldest_query,
+                             value_range_labels)
 
 router = APIRouter(prefix="/dashboard",
                    tags=["dashboard"], dependencies=[Depends(auth)])
 
 
 @router.get("/monthly", response_model=MonthlyDashboardOut)
-def get_monthly_data(month: int = Query(ge=1, le=12), year: int = Query(),
-                     type: ContractType = Query(), current_group=Depends(group_parameters),
-                     db: Database = Depends(get_db)):
+async def get_monthly_data(month: int = Query(ge=1, le=12), year: int = Query(),
+                           type: ContractType = Query(), current_group=Depends(group_parameters),
+                           cache: CachedResponse = Depends(cached_response),
+                           db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Monthly figures of the active contracts of a type, read from the
+    dashboard rollups, or computed from the contracts while the rollups of
+    the group have not been built
+    """
     try:
         date_filter = datetime.strptime(f"{month} {year}", "%m %Y")
     except ValueError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid filter")
-    date_filter_next = date_filter + relativedelta(months=1)
-    pipeline = [
-        {
-            '$match': {
-                '$and': [
-                    current_group,
-                    {
-                        'effective_date': {
-                            '$lt': date_filter_next
-                        }
-                    }, {
-                        'due_date': {
-                            '$gte': date_filter
-                        }
-                    }, {
-                        'contract_status': {
-                            '$nin': [
-                                'inactive'
-                            ]
-                        }
-                    }, {
-                        'type': type
-                    }
-                ]
-            }
-        }, {
-            '$project': {
-                'value': 1,
-                'responsible_id': 1,
-                'category_id': 1,
-                'periodicity': 1,
-                'status': 1,
-                'contract_status': 1
-            }
-        }, {
-            '$lookup': {
-                'from': 'categories',
-                'localField': 'category_id',
-                'foreignField': '_id',
-                'as': 'category_objs'
-            }
-        }, {
-            '$unwind': {
-                'path': '$category_objs'
-            }
-        }, {
-            '$lookup': {
-                'from': 'responsibles',
-                'localField': 'responsible_id',
-                'foreignField': '_id',
-                'as': 'responsible_objs'
-            }
-        }, {
-            '$unwind': {
-                'path': '$responsible_objs'
-            }
-        }, {
-            '$group': {
-                '_id': 'database',
-                'quantity': {
-                    '$sum': 1
-                },
-                'total_value': {
-                    '$sum': '$value'
-                },
-                'average_value': {
-                    '$avg': '$value'
-                },
-                'contracts': {
-                    '$push': {
-                        'value': '$value',
-                        'status': '$contract_status',
-                        'periodicity': '$periodicity',
-                        'responsible': '$responsible_objs.name',
-                        'category': '$category_objs.name'
-                    }
-                }
-            }
-        }
-    ]
-    result = db.contracts.aggregate(pipeline)
-    dashboard = next(result, {})
-    if not dashboard:
-        return MonthlyDashboardOut()
-    by_category = {}
-    by_responsible = {}
-    by_periodicity = {}
-    for contract in dashboard["contracts"]:
-        def update_group(group: dict, key: str):
-            if not group.get(key, False):
-                group[key] = {
-                    "quantity": 0,
-                    "total_value": 0.0
-                }
-            group[key]["quantity"] += 1
-            group[key]["total_value"] += contract["value"]
-        update_group(by_category, contract["category"])
-        update_group(by_responsible, contract["responsible"])
-        update_group(by_periodicity, contract["periodicity"])
+    if cache.response:
+        return cache.response
+    dashboard = await rollups.monthly_dashboard(db, current_group, type, date_filter)
+    if dashboard is None:
+        dashboard = await live_monthly_dashboard(db, current_group, type, date_filter)
+    return await cache.store(dashboard, MonthlyDashboardOut)
 
-    by_category = [{"key": k, **v} for k, v in
-                   heapq.nlargest(10, by_category.items(),
-                                  key=lambda kv: kv[1]["total_value"])]
-    by_responsible = [{"key": k, **v} for k, v in
-                      heapq.nlargest(10, by_responsible.items(),
-                                     key=lambda kv: kv[1]["total_value"])]
-    by_periodicity = [{"key": k, **v} for k, v in by_periodicity.items()]
 
-    for group in (by_category, by_responsible, by_periodicity):
-        for item in group:
-            item["average_value"] = round(
-                item["total_value"] / item["quantity"], 2)
-
-    # get inactive contracts
-    pipeline = [
-        {
-            '$match': {
-                '$and': [
-                    current_group,
-                    {'contract_status': 'inactive'},
-                ]
-            }
-        }, {
-            '$group': {
-                '_id': 'dashboard',
-                'quantity': {
-                    '$sum': 1
-                },
-                'total_value': {
-                    '$sum': '$value'
-                }
-            }
-        }
-    ]
-    result = db.contracts.aggregate(pipeline)
-    inactive_data = next(result, {})
-    if not inactive_data:
-        inactive_data = {
-            "quantity": 0,
-            "total_value": 0.0
-        }
-    else:
-        inactive_data = {
-            "quantity": inactive_data["quantity"],
-            "total_value": inactive_data["total_value"]
-        }
+async def live_monthly_dashboard(db: AsyncIOMotorDatabase, current_group: dict, type: str,
+                                 date_filter: datetime) -> dict:
+    """Monthly dashboard computed from the contracts in a single aggregation"""
+    date_filter_next = date_filter + relativedelta(months=1)
+    pipeline = monthly_pipeline(current_group, type, date_filter,
+                                date_filter_next, rollups.TOP_BUCKETS)
+    facets = await anext(db.contracts.aggregate(pipeline))
+    totals = rollups.summarize("", *total_of(facets["totals"]))
+    inactive = total_of(facets["inactive"])
     return {
-        "quantity": dashboard["quantity"],
-        "total_value": dashboard["total_value"],
-        "average_value": round(dashboard["average_value"], 2),
-        "by_category": by_category,
-        "by_responsible": by_responsible,
-        "by_periodicity": by_periodicity,
-        "inactive_quantity": inactive_data["quantity"],
-        "inactive_total_value": inactive_data['total_value']
+        "quantity": totals["quantity"],
+        "total_value": totals["total_value"],
+        "average_value": totals["average_value"],
+        "by_category": buckets_of(facets["by_category"]),
+        "by_responsible": buckets_of(facets["by_responsible"]),
+        "by_periodicity": buckets_of(facets["by_periodicity"]),
+        "inactive_quantity": inactive[0],
+        "inactive_total_value": round(inactive[1], 2)
     }
 
 
+def total_of(facet: list[dict]) -> tuple[int, float]:
+    """Quantity and total value of an overall $facet branch, which is empty without contracts"""
+    return (facet[0]["quantity"], facet[0]["total_value"]) if facet else (0, 0.0)
+
+
+def buckets_of(facet: list[dict]) -> list[dict]:
+    return [rollups.summarize(row["_id"], row["quantity"], row["total_value"]) for row in facet]
+
+
 @ router.get("/monthly/get_oldest", response_model=OldestDateOut)
-def get_oldest_date(current_group: dict[str, str] = Depends(group_parameters), db: Database = Depends(get_db)):
+async def get_oldest_date(current_group: dict[str, str] = Depends(group_parameters),
+                          cache: CachedResponse = Depends(cached_response),
+                          db: AsyncIOMotorDatabase = Depends(get_db)):
+    if cache.response:
+        return cache.response
     contract = db.contracts.find(
-        {**current_group, "contract_status": {"$nin": ["inactive"]}}, {"_id": 0, "effective_date": 1, "due_date": 1}).sort("effective_date").limit(1)
-    contract = next(contract, {})
+        oldest_query(current_group), {"_id": 0, "effective_date": 1, "due_date": 1}).sort("effective_date").limit(1)
+    contract = await anext(contract, {})
     if not contract:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "No contracts found")
-    return {
+    return await cache.store({
         "year": contract["effective_date"].year,
         "month": contract["effective_date"].month
-    }
+    }, OldestDateOut)
 
 
 @router.get("/annual", response_model=AnnualDashboardOut)
-def get_annual_data(year: int, type: ContractType,
-                    current_group=Depends(group_parameters),
-                    db: Database = Depends(get_db)):
+async def get_annual_data(year: int, type: ContractType,
+                          end_year: int | None = Query(None, description="Last year of a multi-year range"),
+                          range_bounds: list[int] | None = Query(
+                              None, description="Increasing lower bounds of the value ranges"),
+                          current_group=Depends(group_parameters),
+                          cache: CachedResponse = Depends(cached_response),
+                          db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Totals of the active contracts of a type by effective month, year,
+    periodicity and value range, for one year or from year to end_year.
+    Months are keyed "M" for a single year and "YYYY-M" for a range.
+    """
+    end_year = year if end_year is None else end_year
+    if not 0 <= end_year - year < MAX_DASHBOARD_YEARS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid year range")
+    range_bounds = range_bounds or VALUE_RANGE_BOUNDS
+    if any(low >= high for low, high in zip(range_bounds, range_bounds[1:])):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid range bounds")
     try:
-        date_filter_start = datetime(year, 1, 1, 0, 0, 0)
-        date_filter_end = datetime(year, 12, 31, 23, 59, 59)
+        date_filter_start = datetime(year, 1, 1)
+        date_filter_end = datetime(end_year + 1, 1, 1)
     except ValueError:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid year")
-    pipeline = [
-        {
-            '$match': {
-                '$and': [
-                    current_group,
-                    {
-                        'contract_status': 'active'
-                    }, {
-                        'effective_date': {
-                            '$lte': date_filter_end
-                        }
-                    }, {
-                        'effective_date': {
-                            '$gte': date_filter_start
-                        }
-                    }, {
-                        'type': type
-                    }
-                ]
-            }
-        }, {
-            '$project': {
-                '_id': 0,
-                'effective_date': 1,
-                'value': 1,
-                'periodicity': 1,
-                'due_date': 1
-            }
-        }
-    ]
-    result = db.contracts.aggregate(pipeline)
-    """
-    result structure:
-        periodicity: str
-        value: float
-        effective_date: datetime
-        due_date: datetime
-    """
-    contracts = iter(result)
-    by_month = {str(i): {"quantity": 0, "total_value": 0.0}
-                for i in range(1, 13)}
-    periodicity = ("monthly", "bimonthly", "quarterly",
-                   "biannually", "annually")
-    by_periodicity = {p: {"quantity": 0, "total_value": 0.0}
-                      for p in periodicity}
-    ranges = ((0, 1000), (1001, 5000), (5001, 10000), (10001, "inf"))
-    by_value_range = {
-        f"{a} - {b}": 0 for a, b in ranges
-    }
-    for contract in contracts:
-        def update_group(group: dict, key: str):
-            group[key]["quantity"] += 1
-            group[key]["total_value"] += contract["value"]
-        update_group(by_month, str(contract["effective_date"].month))
-        update_group(by_periodicity, contract["periodicity"])
-        # update by_value_range
-        int_value = math.ceil(contract["value"])
-        for l, h in ranges:
-            if h == "inf":
-                by_value_range[f"{l} - {h}"] += 1
-                break
-            else:
-                if int_value in range(l, h+1):
-                    by_value_range[f"{l} - {h}"] += 1
-                    break
-    return {
-        "by_month": [{"key": k, **v} for k, v in by_month.items()],
-        "by_periodicity": [{"key": k, **v} for k, v in by_periodicity.items()],
-        "by_value_range_qty": [{"key": k, "quantity": v} for k, v in by_value_range.items()]
-    }
+    if cache.response:
+        return cache.response
+    pipeline = annual_pipeline(current_group, type, date_filter_start, date_filter_end, range_bounds)
+    facets = await anext(db.contracts.aggregate(pipeline))
+
+    def totals(facet: list[dict], key=lambda id: id) -> dict:
+        return {key(row["_id"]): {"quantity": row["quantity"], "total_value": row["total_value"]}
+                for row in facet}
+    empty = {"quantity": 0, "total_value": 0.0}
+    years = range(year, end_year + 1)
+    months = [(y, m) for y in years for m in range(1, 13)]
+    month_key = (lambda y, m: str(m)) if year == end_year else (lambda y, m: f"{y}-{m}")
+    by_month = totals(facets["by_month"], lambda id: (id["year"], id["month"]))
+    by_year = totals(facets["by_year"])
+    by_periodicity = totals(facets["by_periodicity"])
+    by_value_range = {row["_id"]: row["quantity"] for row in facets["by_value_range"]}
+    labels = value_range_labels(range_bounds)
+    value_ranges = [{"key": label, "quantity": by_value_range.get(bound, 0)}
+                    for bound, label in zip(range_bounds, labels)]
+    if by_value_range.get("below"):
+        value_ranges.insert(0, {"key": f"< {range_bounds[0]}", "quantity": by_value_range["below"]})
+    return await cache.store({
+        "by_month": [{"key": month_key(y, m), **by_month.get((y, m), empty)} for y, m in months],
+        "by_year": [{"key": str(y), **by_year.get(y, empty)} for y in years],
+        "by_periodicity": [{"key": p, **by_periodicity.get(p, empty)} for p in get_args(ContractPeriodicity)],
+        "by_value_range_qty": value_ranges
+    }, AnnualDashboardOut)
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+from const import VALUE_RANGE_BOUNDS
+from dateutil.relativedelta import relativedelta
+from deps import auth, get_db, group_parameters, token_cache
+from fastapi import APIRouter, Depends
+from models.diagnostics import IndexDiagnostics, QueryPlan
+from models.pagination import PageParams
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from utils import downloads, references, response_cache
+from utils.dashboard import annual_pipeline, monthly_pipeline, oldest_query
+from utils.functions import alerts_pipeline, contracts_pipeline
+
+router = APIRouter(prefix="/diagnostics",
+                   tags=["diagnostics"], dependencies=[Depends(auth)])
+
+EXPLAIN_PAGE = 50
+
+
+def main_pipelines(current_group: dict) -> dict[str, list[dict]]:
+    """The hot contract queries, built exactly as the routes build them"""
+    today = datetime.today()
+    month = datetime(today.year, today.month, 1)
+    return {
+        "contracts.list": contracts_pipeline(
+            current_group, PageParams(limit=EXPLAIN_PAGE)),
+        "contracts.list_by_due_date": contracts_pipeline(
+            current_group, PageParams(limit=EXPLAIN_PAGE, sort="due_date")),
+        "alerts": alerts_pipeline(
+            current_group, today, 30, PageParams(limit=EXPLAIN_PAGE, sort="due_date")),
+        "dashboard.monthly": monthly_pipeline(
+            current_group, "liability", month, month + relativedelta(months=1)),
+        "dashboard.annual": annual_pipeline(
+            current_group, "liability", datetime(today.year, 1, 1),
+            datetime(today.year + 1, 1, 1), VALUE_RANGE_BOUNDS),
+        "dashboard.oldest": [
+            {"$match": oldest_query(current_group)},
+            {"$sort": {"effective_date": 1}},
+            {"$limit": 1}
+        ],
+    }
+
+
+def summarize_plan(name: str, explain: dict) -> QueryPlan:
+    """Collect the stages and indexes of the winning plan, ignoring rejected plans"""
+    stages, indexes = [], []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            if isinstance(node.get("indexName"), str):
+                indexes.append(node["indexName"])
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(explain)
+    return QueryPlan(name=name, collscan="COLLSCAN" in stages,
+                     stages=stages, indexes=sorted(set(indexes)))
+
+
+@router.get("/indexes", response_model=IndexDiagnostics)
+async def explain_indexes(current_group: dict = Depends(group_parameters),
+                          db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Explain the main contract pipelines for the current group and report any collection scan"""
+    plans = []
+    for name, pipeline in main_pipelines(current_group).items():
+        explain = await db.command(
+            "explain", {"aggregate": "contracts", "pipeline": pipeline, "cursor": {}},
+            verbosity="queryPlanner")
+        plans.append(summarize_plan(name, explain))
+    return {
+        "plans": plans,
+        "collscans": [plan.name for plan in plans if plan.collscan]
+    }
+
+
+@router.get("/caches", response_model=dict)
+async def cache_stats():
+    """Hit and miss counters of this worker's caches"""
+    return {
+        "responses": response_cache.stats(),
+        "references": references.reference_cache.stats(),
+        "tokens": token_cache.stats(),
+        "file_urls": downloads.url_cache.stats()
+    }
+
@@ -1,13 +1,22 @@
 import os
+from datetime import datetime
+from typing import Literal
 from urllib import parse
 from uuid import uuid4
 
 from botocore.exceptions import ClientError
-from deps import AWSS3, auth, get_db
-from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile, status
+from bson import ObjectId
+from const import FILE_LINKS, FILE_UPLOADS, MAX_PAGE_SIZE
+from deps import auth, get_db, get_storage, group_parameters
+from fastapi import (APIRouter, BackgroundTasks, Body, Depends, HTTPException,
+                     Query, UploadFile, status)
+from fastapi.concurrency import run_in_threadpool
 from models.mongo import PyObjectId
-from pydantic import BaseModel
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel, Field
+from storage import Storage
+from utils import attachments
+from utils.downloads import contract_downloads
 from utils.responses import success_ok
 
 
@@ -15,20 +24,120 @@ class FileCreated(BaseModel):
     path: str
 
 
+class FileUploadRequest(BaseModel):
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+    method: Literal["post", "put"] = "post"
+
+
+class FileUploadUrl(BaseModel):
+    path: str
+    method: Literal["post", "put"]
+    url: str
+    fields: dict[str, str] = {}  # form fields sent before the file, POST only
+    headers: dict[str, str] = {}  # request headers, PUT only
+    expires_in: int
+
+
+class FileLink(BaseModel):
+    filepath: str
+    contract_id: PyObjectId
+
+
+class FileBulkLink(BaseModel):
+    links: list[FileLink] = Field(min_items=1, max_items=FILE_LINKS["max_batch"])
+
+
+class FileBulkUnlink(BaseModel):
+    filepaths: list[str] = Field(min_items=1, max_items=FILE_LINKS["max_batch"])
+
+
+class FileLinkResult(BaseModel):
+    filepath: str
+    contract_id: PyObjectId
+    path: str
+    size: int | None
+    error: str | None
+
+    class Config:
+        json_encoders = {ObjectId: str}
+
+
+class FileUnlinkResult(BaseModel):
+    filepath: str
+    error: str | None
+
+
+class FileDownload(BaseModel):
+    contract_id: PyObjectId
+    path: str
+    filename: str
+    size: int | None
+    url: str
+    expires_at: datetime
+
+    class Config:
+        json_encoders = {ObjectId: str}
+
+
 router = APIRouter(
     prefix="/files", tags=["files"], dependencies=[Depends(auth)])
 
 
+def upload_path(filename: str) -> str:
+    """Unique path of a new upload, keeping the extension of filename"""
+    _, ext = os.path.splitext(filename)
+    return os.path.join("uploads", f"{uuid4().hex}{ext}")
+
+
+def check_upload(content_type: str, size: int | None = None) -> None:
+    if content_type not in FILE_UPLOADS["content_types"]:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="File type not allowed")
+    if size is not None and size > FILE_UPLOADS["max_size"]:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail="File is too large")
+
+
+@router.post("/upload_url", response_model=FileUploadUrl)
+async def create_upload_url(upload: FileUploadRequest, storage: Storage = Depends(get_storage)):
+    """
+    Presigned request uploading a file straight to the S3 bucket, the
+    returned path is then linked to a contract as with /upload
+    """
+    check_upload(upload.content_type, upload.size)
+    filepath = upload_path(upload.filename)
+    # same tagging as /upload, unlinked files are automatically deleted after one day
+    tags = {"status": "unlinked"}
+    expires_in = FILE_UPLOADS["expiry"]
+    # signing may first resolve the credentials (IMDS/STS requests), off the event loop
+    if upload.method == "post":
+        presigned = await run_in_threadpool(storage.presigned_post, filepath, upload.content_type,
+                                            FILE_UPLOADS["max_size"], tags, expires_in)
+    else:
+        presigned = await run_in_threadpool(storage.presigned_put, filepath, upload.content_type,
+                                            upload.size, tags, expires_in)
+    return {
+        "path": filepath,
+        "method": upload.method,
+        "expires_in": expires_in,
+        **presigned
+    }
+
+
 @router.post("/upload", response_model=FileCreated)
-def upload_file(file: UploadFile, s3: AWSS3 = Depends()):
-    """Upload a file to the S3 bucket"""
-    _, ext = os.path.splitext(file.filename)
-    filename = f"{uuid4().hex}{ext}"
-    filepath = os.path.join("uploads", filename)
+async def upload_file(file: UploadFile, storage: Storage = Depends(get_storage)):
+    """
+    Upload a file to the S3 bucket through the API, prefer /upload_url
+    which does not send the file through the API workers
+    """
+    check_upload(file.content_type)
+    filepath = upload_path(file.filename)
     try:
         # Upload the file into the ENV/uploads directory, and tag it as unlinked.
         # Unlinked files are temporary, and are automatically deleted after one day.
-        s3.upload_fileobj(file.file, filepath, {
+        await run_in_threadpool(storage.upload_fileobj, file.file, filepath, {
             "ContentType": file.content_type,
             "Tagging": parse.urlencode({"status": "unlinked"})})
     except ClientError:
@@ -39,65 +148,76 @@ def upload_file(file: UploadFile, s3: AWSS3 = Depends()):
     }
 
 
-@router.post("/link_to_contract")
-def link_to_contract(filepath: str = Body(), contract_id: PyObjectId = Body(),
-                     s3: AWSS3 = Depends(), db: Database = Depends(get_db)):
-    contract = db.contracts.find_one({"_id": contract_id})
-    if not contract:
-        raise HTTPException(status.HTTP_404_NOT_FOUND,
-                            detail="Contract not found")
-    if contract.get("path", False):
-        raise HTTPException(status.HTTP_400_BAD_REQUEST,
-                            "Contract is linked to another file")
-    # check that the file has not already been linked
-    found = db.files.find_one({"path": filepath}, {"_id": 1})
-    if found is not None:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST,
-                            detail="File has already been linked")
-    filename = os.path.basename(filepath)
-    new_path = os.path.join(str(contract_id), filename)
+@router.get("/", response_model=list[FileDownload])
+async def get_download_urls(contract_ids: list[PyObjectId] = Query(..., max_items=MAX_PAGE_SIZE),
+                            current_group=Depends(group_parameters),
+                            storage: Storage = Depends(get_storage),
+                            db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Download URLs of the files of several contracts, contracts without files are skipped"""
+    return await contract_downloads(db, storage, current_group, contract_ids)
 
-    try:
-        s3.move_object(filepath, new_path)
-        # mark the file as linked so it does not get automatically deleted
-        s3.tag_object(new_path, {"status": "linked"})
-    except ClientError as ex:
-        if ex.response["Error"]["Code"] == "NoSuchKey":
-            raise HTTPException(status.HTTP_400_BAD_REQUEST,
-                                detail="File does not exists")
-        raise HTTPException(status.WS_1011_INTERNAL_ERROR,
-                            detail="The S3 service responded with an error")
-    # create a db entry
-    file_info = s3.get_file(new_path)
-    db.files.insert_one({
-        "contract_id": contract["_id"],
-        "path": new_path,
-        "filename": filename,
-        "size": file_info.get("size", None)
-    })
-    # add field to contract
-    db.contracts.update_one({"_id": contract_id}, {
-        "$set": {
-            "path": new_path
-        }
-    })
+
+@router.get("/{contract_id}", response_model=list[FileDownload])
+async def get_download_url(contract_id: PyObjectId, current_group=Depends(group_parameters),
+                           storage: Storage = Depends(get_storage),
+                           db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Short-lived URLs downloading the files of a contract straight from the S3 bucket"""
+    downloads = await contract_downloads(db, storage, current_group, [contract_id])
+    if not downloads:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "File not found")
+    return downloads
+
+
+def raise_for_error(error: str | None) -> None:
+    """Raise the HTTP error of a single file link or unlink"""
+    if error is None:
+        return
+    if error == attachments.CONTRACT_NOT_FOUND:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=error)
+    if error == attachments.STORAGE_ERROR:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail=error)
+    raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=error)
+
+
+@router.post("/link_to_contract")
+async def link_to_contract(background_tasks: BackgroundTasks, filepath: str = Body(),
+                           contract_id: PyObjectId = Body(), storage: Storage = Depends(get_storage),
+                           db: AsyncIOMotorDatabase = Depends(get_db)):
+    results, uploads = await attachments.link_files(
+        db, storage, [{"filepath": filepath, "contract_id": contract_id}])
+    # the upload is deleted after the response, it is still tagged as
+    # unlinked and expires on its own if the delete fails
+    background_tasks.add_task(attachments.delete_uploads, storage, uploads)
+    raise_for_error(results[0]["error"])
     return success_ok()
 
 
+@router.post("/bulk/link", response_model=list[FileLinkResult])
+async def bulk_link(operation: FileBulkLink, background_tasks: BackgroundTasks,
+                    current_group=Depends(group_parameters), storage: Storage = Depends(get_storage),
+                    db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Link several uploads to contracts of the group, a contract can have up to
+    FILE_LINKS["max_files"] files. Every link has its result, error is set
+    for the ones that failed.
+    """
+    results, uploads = await attachments.link_files(
+        db, storage, [link.dict() for link in operation.links], current_group)
+    background_tasks.add_task(attachments.delete_uploads, storage, uploads)
+    return results
+
+
 @router.post("/unlink")
-def unlink_file(filepath: str = Body(), db: Database = Depends(get_db), s3: AWSS3 = Depends()):
-    file = db.files.find_one({"path": filepath})
-    if not file:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, "File not found")
-    db.contracts.update_one({"_id": file["contract_id"]}, {
-        "$unset": {
-            "path": True
-        }
-    })
-    try:
-        s3.tag_object(filepath, {"status": "unlinked"})
-    except ClientError:
-        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            "The S3 service returned an error")
-    db.files.delete_one({"_id": file["_id"]})
+async def unlink_file(filepath: str = Body(), db: AsyncIOMotorDatabase = Depends(get_db),
+                      storage: Storage = Depends(get_storage)):
+    results = await attachments.unlink_files(db, storage, [filepath])
+    raise_for_error(results[0]["error"])
     return success_ok()
+
+
+@router.post("/bulk/unlink", response_model=list[FileUnlinkResult])
+async def bulk_unlink(operation: FileBulkUnlink, current_group=Depends(group_parameters),
+                      storage: Storage = Depends(get_storage),
+                      db: AsyncIOMotorDatabase = Depends(get_db)):
+    """Unlink several files from the contracts of the group, error is set for the ones that failed"""
+    return await attachments.unlink_files(db, storage, operation.filepaths, current_group)
@@ -0,0 +1,85 @@
+"""
+Endpoints of the presigned URLs of the local storage backend, included only
+when STORAGE["backend"] is "local": download, form (POST) upload and PUT
+upload, with the same size and content type limits as the S3 policies.
+"""
+from io import BytesIO
+from typing import BinaryIO
+from urllib import parse
+from xml.etree import ElementTree
+
+from botocore.exceptions import ClientError
+from const import FILE_UPLOADS, STORAGE
+from deps import get_storage
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+from starlette.datastructures import UploadFile
+from storage import LocalStorage
+
+router = APIRouter(prefix=parse.urlparse(STORAGE["local_url"]).path.rstrip("/"),
+                   tags=["local storage"], include_in_schema=False)
+
+
+def object_name(storage: LocalStorage, key: str) -> str:
+    try:
+        return storage.object_name(key)
+    except ClientError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="NoSuchKey")
+
+
+def check_upload(content_type: str | None, size: int) -> None:
+    if content_type not in FILE_UPLOADS["content_types"]:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Content-Type not allowed")
+    if not 0 < size <= FILE_UPLOADS["max_size"]:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="EntityTooLarge")
+
+
+def parse_tagging_xml(tagging: str) -> dict[str, str]:
+    try:
+        root = ElementTree.fromstring(tagging)
+    except ElementTree.ParseError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="MalformedXML")
+    return {tag.findtext("Key"): tag.findtext("Value") for tag in root.iter("Tag")}
+
+
+async def save(storage: LocalStorage, name: str, file: BinaryIO, tags: dict[str, str]) -> None:
+    try:
+        await run_in_threadpool(storage.upload_fileobj, file, name, {"Tagging": parse.urlencode(tags)})
+    except ClientError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="NoSuchKey")
+
+
+@router.get("/{key:path}")
+async def download(key: str, filename: str | None = None, storage: LocalStorage = Depends(get_storage)):
+    try:
+        path = storage.file_path(object_name(storage, key))
+    except ClientError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="NoSuchKey")
+    return FileResponse(path, filename=filename)
+
+
+@router.put("/{key:path}")
+async def put_upload(key: str, request: Request, content_type: str | None = Header(None),
+                     x_amz_tagging: str = Header(""), storage: LocalStorage = Depends(get_storage)):
+    name = object_name(storage, key)
+    body = await request.body()
+    check_upload(content_type, len(body))
+    await save(storage, name, BytesIO(body), dict(parse.parse_qsl(x_amz_tagging)))
+    return Response(status_code=status.HTTP_200_OK)
+
+
+@router.post("/")
+async def post_upload(request: Request, storage: LocalStorage = Depends(get_storage)):
+    form = await request.form()
+    file = form.get("file")
+    if not isinstance(file, UploadFile) or not form.get("key"):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="InvalidArgument")
+    name = object_name(storage, form["key"])
+    file.file.seek(0, 2)
+    size = file.file.tell()
+    file.file.seek(0)
+    check_upload(form.get("Content-Type"), size)
+    tags = parse_tagging_xml(form["tagging"]) if form.get("tagging") else {}
+    await save(storage, name, file.file, tags)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
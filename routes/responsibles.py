@@ -1,48 +1,38 @@
-from database import MongoCon
 from deps import auth, get_db, group_parameters
 from fastapi import APIRouter, Depends, HTTPException, status
 from models.mongo import PyObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from models.responsible import ResponsibleIn, ResponsibleOut
 from pymongo import ReturnDocument
-from pymongo.database import Database
 from pymongo.errors import DuplicateKeyError
+from utils import references, response_cache
 
 router = APIRouter(
     prefix="/responsibles", tags=["responsibles"], dependencies=[Depends(auth)]
 )
 
 
-@router.on_event("startup")
-def router_setup() -> None:
-    """Setup the unique index for the Mongo database"""
-    try:
-        with MongoCon() as db:  # can not use dependencies on event handlers
-            db.responsibles.create_index(
-                [("group_code", 1), ("dealer_code", 1), ("name", 1)], unique=True
-            )
-    except:
-        pass
-
-
 @router.post(
     "/", status_code=status.HTTP_201_CREATED, response_model=ResponsibleOut
 )
-def create_responsible(
+async def create_responsible(
     responsible: ResponsibleIn,
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Create a new responsible for the current group"""
     responsible_data = {**current_group, **responsible.dict()}
     try:
-        new_responsible = db.responsibles.insert_one(responsible_data)
+        new_responsible = await db.responsibles.insert_one(responsible_data)
     except DuplicateKeyError:
         # if the insertion violates the predefined index
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST,
             detail=f"Duplicate name for {current_group['dealer_code']}"
         )
-    created_responsible = db.responsibles.find_one(
+    references.invalidate("responsibles", current_group)
+    await response_cache.mark_group_changed(db, current_group)
+    created_responsible = await db.responsibles.find_one(
         {"_id": new_responsible.inserted_id}
     )
     return created_responsible
@@ -51,21 +41,21 @@ def create_responsible(
 @router.get(
     "/", response_model=list[ResponsibleOut]
 )
-def list_responsibles(
+async def list_responsibles(
     current_group: dict = Depends(group_parameters),
-    db: Database = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Return all of the responsibles for the specified group"""
     responsibles = db.responsibles.find(current_group)
-    return list(responsibles)
+    return await responsibles.to_list(None)
 
 
 @router.put("/{id}", response_model=ResponsibleOut)
-def update_responsible(
-    id: PyObjectId, responsible: ResponsibleIn, db: Database = Depends(get_db)
+async def update_responsible(
+    id: PyObjectId, responsible: ResponsibleIn, db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     try:
-        updated_responsible = db.responsibles.find_one_and_update(
+        updated_responsible = await db.responsibles.find_one_and_update(
             {"_id": id}, {"$set": responsible.dict()}, return_document=ReturnDocument.AFTER
         )
     except DuplicateKeyError:
@@ -74,4 +64,10 @@ def update_responsible(
     if updated_responsible is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND,
                             detail="Responsible not found")
+    references.invalidate("responsibles", updated_responsible)
+    # contracts keep a copy of the name, propagate the rename
+    await db.contracts.update_many(
+        {"responsible_id": id}, {"$set": {"responsible": updated_responsible["name"]}}
+    )
+    await response_cache.mark_group_changed(db, updated_responsible)
     return updated_responsible
@@ -0,0 +1,384 @@
+"""
+File storage of the contract documents.
+
+Object names are relative to AWS_S3_ROOT_FOLDER. The S3 backend uses one
+client per process, created on first use with the STORAGE pool, timeout and
+retry settings, so its connections are reused across requests. The local
+backend keeps the objects under STORAGE["local_root"] for development and
+benchmarks without AWS; it raises the same ClientError codes as S3, so the
+routes handle both alike.
+"""
+import json
+import os
+import shutil
+from abc import ABC, abstractmethod
+from typing import Any, BinaryIO
+from urllib import parse
+from xml.sax.saxutils import escape
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from const import AWS_S3_BUCKET_NAME, AWS_S3_ROOT_FOLDER, STORAGE
+
+_storage: "Storage | None" = None
+
+
+def get_tag_set(tags: dict[str, str]) -> list[dict[str, str]]:
+    return [{"Key": key, "Value": value} for key, value in tags.items()]
+
+
+def get_tagging_xml(tags: dict[str, str]) -> str:
+    """Tags in the XML form expected by the tagging field of a POST upload"""
+    tag_set = "".join(f"<Tag><Key>{escape(key)}</Key><Value>{escape(value)}</Value></Tag>"
+                      for key, value in tags.items())
+    return f"<Tagging><TagSet>{tag_set}</TagSet></Tagging>"
+
+
+def content_disposition(filename: str) -> str:
+    """Attachment disposition of filename (RFC 6266), with an ASCII fallback for older clients"""
+    fallback = "".join(char if char.isascii() and char.isprintable() and char not in '"\\' else "_"
+                       for char in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{parse.quote(filename, safe='')}"
+
+
+class Storage(ABC):
+    """Operations on the stored files, every method blocks"""
+    ROOT_FOLDER = AWS_S3_ROOT_FOLDER
+
+    @abstractmethod
+    def upload_fileobj(self, file: BinaryIO, object_name: str, ExtraArgs: dict | None = None) -> Any:
+        """Upload a file-like object, ExtraArgs may set its ContentType and Tagging"""
+
+    @abstractmethod
+    def presigned_post(self, object_name: str, content_type: str, max_size: int,
+                       tags: dict[str, str], expires_in: int) -> dict:
+        """url and form fields of an upload the client sends itself"""
+
+    @abstractmethod
+    def presigned_put(self, object_name: str, content_type: str, size: int,
+                      tags: dict[str, str], expires_in: int) -> dict:
+        """url and headers of an upload the client sends itself"""
+
+    @abstractmethod
+    def presigned_get(self, object_name: str, filename: str, expires_in: int) -> str:
+        """URL downloading an object as filename"""
+
+    @abstractmethod
+    def tag_object(self, object_name: str, tags: dict[str, str]) -> Any:
+        """Replace the tags of an object"""
+
+    @abstractmethod
+    def move_object(self, original_path: str, new_path: str, tags: dict[str, str] | None = None) -> int:
+        """Copy an object to new_path, replacing its tags when given, and return its size"""
+
+    @abstractmethod
+    def delete_object(self, object_name: str) -> Any:
+        """Delete an object, deleting a missing object is not an error"""
+
+    @abstractmethod
+    def get_file(self, filepath: str) -> dict:
+        """path and size of an object, empty if it does not exist"""
+
+
+class S3Storage(Storage):
+    """Logic for uploading and downloading AWS S3 files"""
+    BUCKET_NAME = AWS_S3_BUCKET_NAME
+
+    def __init__(self, client: Any = None):
+        self.client = client or create_s3_client()
+
+    def upload_fileobj(self, file: BinaryIO, object_name: str, ExtraArgs: dict | None = None) -> Any:
+        """Upload a file-like object to an S3 bucket
+
+        Args:
+            file (BinaryIO): The file-like object to upload
+            object_name (str): S3 object name
+
+        Returns:
+            Any: The S3 client response
+
+        Raises:
+            ClientError: The S3 service responded with an error
+        """
+        return self.client.upload_fileobj(
+            file, self.BUCKET_NAME, os.path.join(
+                self.ROOT_FOLDER, object_name), ExtraArgs=ExtraArgs)
+
+    def presigned_post(self, object_name: str, content_type: str, max_size: int,
+                       tags: dict[str, str], expires_in: int) -> dict:
+        """Presigned POST of a new object, the client must send the returned fields
+        with the file. The policy enforces the size, content type and tags.
+
+        Returns:
+            dict: The url and fields of the form upload
+        """
+        tagging = get_tagging_xml(tags)
+        return self.client.generate_presigned_post(
+            Bucket=self.BUCKET_NAME,
+            Key=os.path.join(self.ROOT_FOLDER, object_name),
+            Fields={"Content-Type": content_type, "tagging": tagging},
+            Conditions=[
+                ["content-length-range", 1, max_size],
+                {"Content-Type": content_type},
+                {"tagging": tagging}
+            ],
+            ExpiresIn=expires_in)
+
+    def presigned_put(self, object_name: str, content_type: str, size: int,
+                      tags: dict[str, str], expires_in: int) -> dict:
+        """Presigned PUT of a new object, the client must send the returned
+        headers with exactly size bytes.
+
+        Returns:
+            dict: The url and headers of the upload
+        """
+        tagging = parse.urlencode(tags)
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.BUCKET_NAME,
+                "Key": os.path.join(self.ROOT_FOLDER, object_name),
+                "ContentType": content_type,
+                "ContentLength": size,
+                "Tagging": tagging
+            },
+            ExpiresIn=expires_in)
+        return {
+            "url": url,
+            "headers": {
+                "Content-Type": content_type,
+                "Content-Length": str(size),
+                "x-amz-tagging": tagging
+            }
+        }
+
+    def presigned_get(self, object_name: str, filename: str, expires_in: int) -> str:
+        """Presigned GET of an object, downloaded as filename
+
+        Returns:
+            str: The download URL
+        """
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.BUCKET_NAME,
+                "Key": os.path.join(self.ROOT_FOLDER, object_name),
+                "ResponseContentDisposition": content_disposition(filename)
+            },
+            ExpiresIn=expires_in)
+
+    def tag_object(self, object_name: str, tags: dict[str, str]) -> Any:
+        """Put key-value tags onto the specified object
+
+        Args:
+            object_name (str): S3 object name
+            tags (dict[str, str]): List of key-value tags
+
+        Returns:
+            Any: S3 client response
+
+        Raises:
+            ClientError: The S3 service responded with an error
+        """
+        return self.client.put_object_tagging(
+            Bucket=self.BUCKET_NAME,
+            Key=os.path.join(self.ROOT_FOLDER, object_name),
+            Tagging={
+                "TagSet": get_tag_set(tags)
+            }
+        )
+
+    def move_object(self, original_path: str, new_path: str, tags: dict[str, str] | None = None) -> int:
+        """Copy an object to new_path, replacing its tags when given. The
+        original is left in place, delete it with delete_object.
+
+        Returns:
+            int: The object size
+
+        Raises:
+            ClientError: The object does not exist or S3 responded with an error
+        """
+        original_path = os.path.join(self.ROOT_FOLDER, original_path)
+        # raises exception if file does not exist
+        response = self.client.head_object(Bucket=self.BUCKET_NAME, Key=original_path)
+        copy_source = {
+            "Bucket": self.BUCKET_NAME,
+            "Key": original_path
+        }
+        extra_args = {}
+        if tags is not None:
+            extra_args = {"TaggingDirective": "REPLACE", "Tagging": parse.urlencode(tags)}
+        self.client.copy_object(Bucket=self.BUCKET_NAME, CopySource=copy_source,
+                                Key=os.path.join(self.ROOT_FOLDER, new_path), **extra_args)
+        return response["ContentLength"]
+
+    def delete_object(self, object_name: str) -> Any:
+        return self.client.delete_object(Bucket=self.BUCKET_NAME,
+                                         Key=os.path.join(self.ROOT_FOLDER, object_name))
+
+    def get_file(self, filepath: str) -> dict:
+        filepath = os.path.join(self.ROOT_FOLDER, filepath)
+        try:
+            response = self.client.head_object(
+                Bucket=self.BUCKET_NAME, Key=filepath)
+        except ClientError:
+            return {}
+        return {
+            "path": filepath,
+            "size": response["ContentLength"]
+        }
+
+
+class LocalStorage(Storage):
+    """
+    Files under a local directory, the tags of each file are kept next to it
+    in <name>.tags.json. The presigned URLs point to STORAGE["local_url"],
+    served by routes/local_storage.py when this backend is selected. They are
+    not signed and do not expire: this backend is for development only.
+    """
+
+    def __init__(self, root: str | None = None, base_url: str | None = None):
+        self.root = os.path.abspath(os.path.join(root or STORAGE["local_root"], self.ROOT_FOLDER))
+        self.base_url = (base_url or STORAGE["local_url"]).rstrip("/")
+
+    def local_path(self, object_name: str, operation: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, object_name))
+        if os.path.commonpath([self.root, path]) != self.root:
+            # outside of the storage, as if it did not exist
+            raise error("NoSuchKey", operation)
+        return path
+
+    def write_tags(self, path: str, tags: dict[str, str]) -> None:
+        with open(f"{path}.tags.json", "w") as file:
+            json.dump(tags, file)
+
+    def read_tags(self, object_name: str) -> dict[str, str]:
+        path = self.local_path(object_name, "GetObjectTagging")
+        try:
+            with open(f"{path}.tags.json") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def upload_fileobj(self, file: BinaryIO, object_name: str, ExtraArgs: dict | None = None) -> Any:
+        path = self.local_path(object_name, "PutObject")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as destination:
+            shutil.copyfileobj(file, destination)
+        tagging = (ExtraArgs or {}).get("Tagging")
+        self.write_tags(path, dict(parse.parse_qsl(tagging)) if tagging else {})
+
+    def presigned_post(self, object_name: str, content_type: str, max_size: int,
+                       tags: dict[str, str], expires_in: int) -> dict:
+        return {
+            "url": f"{self.base_url}/",
+            "fields": {
+                "key": os.path.join(self.ROOT_FOLDER, object_name),
+                "Content-Type": content_type,
+                "tagging": get_tagging_xml(tags)
+            }
+        }
+
+    def presigned_put(self, object_name: str, content_type: str, size: int,
+                      tags: dict[str, str], expires_in: int) -> dict:
+        return {
+            "url": f"{self.base_url}/{parse.quote(os.path.join(self.ROOT_FOLDER, object_name))}",
+            "headers": {
+                "Content-Type": content_type,
+                "Content-Length": str(size),
+                "x-amz-tagging": parse.urlencode(tags)
+            }
+        }
+
+    def presigned_get(self, object_name: str, filename: str, expires_in: int) -> str:
+        key = parse.quote(os.path.join(self.ROOT_FOLDER, object_name))
+        return f"{self.base_url}/{key}?{parse.urlencode({'filename': filename})}"
+
+    def object_name(self, key: str) -> str:
+        """Object name of a key of the presigned URLs, which includes ROOT_FOLDER"""
+        prefix = f"{self.ROOT_FOLDER}/"
+        if not key.startswith(prefix):
+            raise error("NoSuchKey", "GetObject")
+        return key[len(prefix):]
+
+    def file_path(self, object_name: str) -> str:
+        """Local path of an existing object"""
+        path = self.local_path(object_name, "GetObject")
+        if not os.path.isfile(path):
+            raise error("NoSuchKey", "GetObject")
+        return path
+
+    def tag_object(self, object_name: str, tags: dict[str, str]) -> Any:
+        path = self.local_path(object_name, "PutObjectTagging")
+        if not os.path.isfile(path):
+            raise error("NoSuchKey", "PutObjectTagging")
+        self.write_tags(path, tags)
+
+    def move_object(self, original_path: str, new_path: str, tags: dict[str, str] | None = None) -> int:
+        source = self.local_path(original_path, "HeadObject")
+        if not os.path.isfile(source):
+            raise error("404", "HeadObject")
+        destination = self.local_path(new_path, "CopyObject")
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        self.write_tags(destination, tags if tags is not None else self.read_tags(original_path))
+        return os.path.getsize(destination)
+
+    def delete_object(self, object_name: str) -> Any:
+        path = self.local_path(object_name, "DeleteObject")
+        for name in (path, f"{path}.tags.json"):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def get_file(self, filepath: str) -> dict:
+        try:
+            path = self.local_path(filepath, "HeadObject")
+        except ClientError:
+            return {}
+        if not os.path.isfile(path):
+            return {}
+        return {
+            "path": os.path.join(self.ROOT_FOLDER, filepath),
+            "size": os.path.getsize(path)
+        }
+
+
+def error(code: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": "Not Found"}}, operation)
+
+
+def create_s3_client() -> Any:
+    """Build an S3 client with the pool, timeout and retry settings of STORAGE"""
+    config = Config(
+        max_pool_connections=STORAGE["max_pool_connections"],
+        connect_timeout=STORAGE["connect_timeout"],
+        read_timeout=STORAGE["read_timeout"],
+        retries={"max_attempts": STORAGE["retries"], "mode": "standard"}
+    )
+    return boto3.session.Session().client("s3", config=config)
+
+
+def create_storage() -> Storage:
+    if STORAGE["backend"] == "local":
+        return LocalStorage()
+    return S3Storage()
+
+
+def get_storage() -> Storage:
+    """Return the process-wide storage, created on first use"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def close() -> None:
+    """Close the process-wide storage and release its connection pool"""
+    global _storage
+    if isinstance(_storage, S3Storage):
+        _storage.client.close()
+    _storage = None
@@ -0,0 +1,48 @@
+from tempfile import SpooledTemporaryFile
+
+from bson import ObjectId
+from utils.imports import ContractImporter, build_batch, read_rows
+
+
+def upload(content: bytes) -> SpooledTemporaryFile:
+    """The file object of a Starlette UploadFile"""
+    file = SpooledTemporaryFile(max_size=1024 * 1024)
+    file.write(content)
+    file.seek(0)
+    return file
+
+
+def test_read_csv_rows_from_spooled_upload():
+    file = upload("﻿contractor_name,value,notes\r\nAcme,10,\"two\r\nlines\"\r\nZoë,,\r\n".encode())
+    rows = list(read_rows(file, "csv"))
+    assert rows == [
+        {"contractor_name": "Acme", "value": "10", "notes": "two\r\nlines"},
+        {"contractor_name": "Zoë"}
+    ]
+    assert not file.closed
+
+
+def test_read_ndjson_rows_from_spooled_upload():
+    file = upload(b'{"contractor_name": "Acme"}\n\n[1]\nnot json\n')
+    rows = list(read_rows(file, "ndjson"))
+    assert rows[0] == {"contractor_name": "Acme"}
+    assert [str(row) for row in rows[1:]] == ["Expected a JSON object", "Invalid JSON"]
+
+
+def test_read_rows_keep_unicode_line_boundaries_in_values():
+    file = upload('contractor_name,value\nAcme\x0cCo,5\n'.encode())
+    assert list(read_rows(file, "csv")) == [{"contractor_name": "Acme\x0cCo", "value": "5"}]
+    file = upload('{"contractor_name": "Acme\u2028Co", "notes": "a\x85b"}\n'.encode())
+    assert list(read_rows(file, "ndjson")) == [{"contractor_name": "Acme\u2028Co", "notes": "a\x85b"}]
+
+
+def test_unhashable_category_is_a_row_error():
+    category_id, responsible_id = ObjectId(), ObjectId()
+    importer = ContractImporter({"group_code": "G", "dealer_code": "D"},
+                                {category_id: {"name": "Cleaning"}},
+                                {responsible_id: {"name": "Ann"}}, {})
+    rows = iter([{"category": ["Cleaning"], "responsible": "Ann"},
+                 {"category_id": {"$oid": str(category_id)}, "responsible": "Ann"}])
+    documents, errors, count = build_batch(rows, importer, 1, 10)
+    assert (documents, count) == ([], 2)
+    assert errors == [{"row": 1, "errors": ["Invalid category"]}, {"row": 2, "errors": ["Invalid category"]}]
@@ -0,0 +1,27 @@
+import base64
+
+import pytest
+from bson import ObjectId, json_util
+
+from utils.pagination import decode_cursor, encode_cursor
+
+
+def cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode()
+
+
+def test_decode_cursor_round_trip():
+    id = ObjectId()
+    assert decode_cursor(encode_cursor("_id", {"_id": id})) == {"sort": "_id", "_id": id}
+
+
+@pytest.mark.parametrize("payload", [[1], {"_id": 1}, {"sort": 1, "_id": 1}, {"sort": ["_id"], "_id": 1},
+                                     {"sort": "name", "_id": 1}, {"sort": "due_date", "_id": 1}])
+def test_decode_cursor_rejects_malformed_payloads(payload):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor(payload))
+
+
+def test_decode_cursor_rejects_invalid_encoding():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
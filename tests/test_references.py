@@ -0,0 +1,44 @@
+import asyncio
+
+from bson import ObjectId
+from utils import references
+
+GROUP = {"group_code": "G", "dealer_code": "D"}
+
+
+class Collection:
+    """find() of a collection whose reads take the snapshot of when they start and wait for release"""
+
+    def __init__(self):
+        self.documents = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    def find(self, query):
+        snapshot = list(self.documents)
+        self.started.set()
+
+        async def read():
+            await self.release.wait()
+            for document in snapshot:
+                yield document
+        return read()
+
+
+def test_invalidate_discards_the_load_in_flight():
+    async def run():
+        categories = Collection()
+        db = {"categories": categories}
+        stale = asyncio.ensure_future(references.get_categories(db, GROUP))
+        await categories.started.wait()
+        category = {"_id": ObjectId(), "name": "Cleaning"}
+        categories.documents.append(category)
+        references.invalidate("categories", GROUP)
+        fresh = asyncio.ensure_future(references.get_categories(db, GROUP))
+        await asyncio.sleep(0)
+        categories.release.set()
+        assert await stale == {}
+        assert await fresh == {category["_id"]: category}
+        assert await references.get_categories(db, GROUP) == {category["_id"]: category}
+        references.invalidate("categories")
+    asyncio.run(run())
@@ -0,0 +1,13 @@
+from utils.search import normalize, search_fields
+
+
+def test_normalize_strips_accents_and_punctuation():
+    assert normalize("José Pérez & Hijos, S.A.") == "jose perez hijos s a"
+    assert normalize("Straße_GmbH") == "strasse gmbh"
+
+
+def test_normalize_keeps_non_latin_scripts():
+    assert normalize("ООО «Ромашка»") == "ооо ромашка"
+    assert normalize("Ελληνική Εταιρεία") == "ελληνικη εταιρεια"
+    assert normalize("株式会社 東京") == "株式会社 東京"
+    assert search_fields("삼성전자 (주)")["search_tokens"] == ["삼성전자", "주"]
@@ -0,0 +1,8 @@
+from storage import content_disposition
+
+
+def test_content_disposition_encodes_the_filename():
+    assert content_disposition("my file.pdf") == \
+        "attachment; filename=\"my file.pdf\"; filename*=UTF-8''my%20file.pdf"
+    assert content_disposition('Zoë "q".pdf') == \
+        "attachment; filename=\"Zo_ _q_.pdf\"; filename*=UTF-8''Zo%C3%AB%20%22q%22.pdf"
@@ -0,0 +1,199 @@
+"""
+Files attached to contracts, several per contract.
+
+db.files holds one document per linked file and is the source of truth;
+the contract keeps the paths of its files in its paths array. Linking moves
+each upload to <contract_id>/<filename> tagged as linked, unlinking tags the
+file back as unlinked so it expires on its own. The storage calls of a batch
+run concurrently on a bounded thread pool, then the files and contracts are
+written with one bulk operation each. Every file gets its own result: a
+failed file does not fail the others.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from botocore.exceptions import ClientError
+from bson import ObjectId
+from const import FILE_LINKS
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+CONTRACT_NOT_FOUND = "Contract not found"
+ALREADY_LINKED = "File has already been linked"
+TOO_MANY_FILES = "Contract has too many files"
+FILE_NOT_FOUND = "File not found"
+UPLOAD_NOT_FOUND = "File does not exists"
+STORAGE_ERROR = "The S3 service responded with an error"
+DUPLICATE_KEY = 11000
+
+executor = ThreadPoolExecutor(max_workers=FILE_LINKS["workers"], thread_name_prefix="storage")
+
+
+async def run_all(fn: Callable, calls: list[tuple]) -> list[Any]:
+    """fn(*args) for every args of calls on the storage pool, the exception of a call is returned as its result"""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(executor, fn, *args) for args in calls),
+                                return_exceptions=True)
+
+
+def storage_error(ex: BaseException, not_found: str) -> str:
+    if isinstance(ex, ClientError) and ex.response["Error"]["Code"] in ("NoSuchKey", "404"):
+        return not_found
+    logger.warning("Storage operation failed: %s", ex)
+    return STORAGE_ERROR
+
+
+async def link_files(db: AsyncIOMotorDatabase, storage: Storage, links: list[dict],
+                     current_group: dict | None = None) -> tuple[list[dict], list[str]]:
+    """
+    Link each upload of links ({filepath, contract_id}) to its contract, of
+    the group when given. Returns the result of every link and the uploads
+    that were copied, which must be deleted with delete_uploads.
+    """
+    results = [{"filepath": link["filepath"], "contract_id": link["contract_id"],
+                "path": None, "size": None, "error": None} for link in links]
+    for result in results:
+        result["path"] = os.path.join(str(result["contract_id"]), os.path.basename(result["filepath"]))
+
+    contract_ids = list({result["contract_id"] for result in results})
+    contracts = db.contracts.find({**(current_group or {}), "_id": {"$in": contract_ids}}, {"_id": 1})
+    found = {contract["_id"] async for contract in contracts}
+    paths = [result["filepath"] for result in results] + [result["path"] for result in results]
+    linked = {file["path"] async for file in db.files.find({"path": {"$in": paths}}, {"path": 1})}
+    counts = db.files.aggregate([
+        {"$match": {"contract_id": {"$in": contract_ids}}},
+        {"$group": {"_id": "$contract_id", "count": {"$sum": 1}}}
+    ])
+    counts = {row["_id"]: row["count"] async for row in counts}
+
+    seen_uploads, seen_paths = set(), set()
+    for result in results:
+        if result["contract_id"] not in found:
+            result["error"] = CONTRACT_NOT_FOUND
+        elif (result["filepath"] in linked or result["path"] in linked
+              or result["filepath"] in seen_uploads or result["path"] in seen_paths):
+            result["error"] = ALREADY_LINKED
+        elif counts.get(result["contract_id"], 0) >= FILE_LINKS["max_files"]:
+            result["error"] = TOO_MANY_FILES
+        else:
+            seen_uploads.add(result["filepath"])
+            seen_paths.add(result["path"])
+            counts[result["contract_id"]] = counts.get(result["contract_id"], 0) + 1
+
+    pending = [result for result in results if result["error"] is None]
+    # copy the files tagged as linked, so that they do not get automatically deleted
+    sizes = await run_all(storage.move_object, [(result["filepath"], result["path"], {"status": "linked"})
+                                                for result in pending])
+    moved = []
+    for result, size in zip(pending, sizes):
+        if isinstance(size, BaseException):
+            result["error"] = storage_error(size, UPLOAD_NOT_FOUND)
+        else:
+            result["size"] = size
+            moved.append(result)
+    if moved:
+        await write_links(db, storage, moved)
+    moved = [result for result in moved if result["error"] is None]
+    return results, [result["filepath"] for result in moved]
+
+
+async def write_links(db: AsyncIOMotorDatabase, storage: Storage, moved: list[dict]) -> None:
+    """
+    Insert the db.files documents of the copied files and add their paths to
+    the contracts. When the writes fail, the documents and the copies of this
+    request are deleted, the copies would otherwise stay tagged as linked for
+    good, and the error is raised. The uploads are kept and expire on their own.
+    """
+    documents = [{
+        "contract_id": result["contract_id"],
+        "path": result["path"],
+        "filename": os.path.basename(result["path"]),
+        "size": result["size"]
+    } for result in moved]
+    owned = moved
+    try:
+        try:
+            await db.files.insert_many(documents, ordered=False)
+        except BulkWriteError as ex:
+            errors = ex.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            # linked concurrently by another request, which owns the file now
+            failed = {error["index"] for error in errors}
+            for index in failed:
+                moved[index]["error"] = ALREADY_LINKED
+            owned = [result for index, result in enumerate(moved) if index not in failed]
+        paths_by_contract: dict[ObjectId, list[str]] = {}
+        for result in owned:
+            paths_by_contract.setdefault(result["contract_id"], []).append(result["path"])
+        if paths_by_contract:
+            await db.contracts.bulk_write([
+                UpdateOne({"_id": contract_id}, {"$addToSet": {"paths": {"$each": paths}}})
+                for contract_id, paths in paths_by_contract.items()
+            ], ordered=False)
+    except PyMongoError:
+        # insert_many set the _id of the documents, only ours are deleted
+        await db.files.delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+        responses = await run_all(storage.delete_object, [(result["path"],) for result in owned])
+        for result, response in zip(owned, responses):
+            if isinstance(response, BaseException):
+                logger.warning("Could not delete the copy %s: %s", result["path"], response)
+        raise
+
+
+async def unlink_files(db: AsyncIOMotorDatabase, storage: Storage, filepaths: list[str],
+                       current_group: dict | None = None) -> list[dict]:
+    """Unlink each linked file of filepaths from its contract, of the group when given"""
+    results = [{"filepath": filepath, "error": None} for filepath in dict.fromkeys(filepaths)]
+    files = {file["path"]: file async for file in db.files.find({"path": {"$in": list(filepaths)}})}
+    if current_group is not None:
+        contract_ids = [file["contract_id"] for file in files.values()]
+        contracts = db.contracts.find({**current_group, "_id": {"$in": contract_ids}}, {"_id": 1})
+        in_group = {contract["_id"] async for contract in contracts}
+        files = {path: file for path, file in files.items() if file["contract_id"] in in_group}
+    for result in results:
+        if result["filepath"] not in files:
+            result["error"] = FILE_NOT_FOUND
+
+    pending = [result for result in results if result["error"] is None]
+    responses = await run_all(storage.tag_object, [(result["filepath"], {"status": "unlinked"})
+                                                   for result in pending])
+    unlinked = []
+    for result, response in zip(pending, responses):
+        if isinstance(response, BaseException):
+            result["error"] = storage_error(response, FILE_NOT_FOUND)
+        else:
+            unlinked.append(result["filepath"])
+    if unlinked:
+        await db.contracts.bulk_write([
+            UpdateMany({"paths": {"$in": unlinked}}, {"$pull": {"paths": {"$in": unlinked}}}),
+            # contracts linked before they could have several files
+            UpdateMany({"path": {"$in": unlinked}}, {"$unset": {"path": True}})
+        ], ordered=False)
+        await db.files.delete_many({"_id": {"$in": [files[path]["_id"] for path in unlinked]}})
+    return results
+
+
+def delete_uploads(storage: Storage, filepaths: list[str]) -> None:
+    """
+    Delete the uploads of linked files, after the response. An upload that
+    fails to delete is still tagged as unlinked and expires on its own.
+    """
+    for filepath, error in zip(filepaths, executor.map(try_delete, [storage] * len(filepaths), filepaths)):
+        if error is not None:
+            logger.warning("Could not delete the linked upload %s: %s", filepath, error)
+
+
+def try_delete(storage: Storage, filepath: str) -> ClientError | None:
+    try:
+        storage.delete_object(filepath)
+    except ClientError as ex:
+        return ex
+    return None
@@ -0,0 +1,92 @@
+"""
+Bulk update and delete of the contracts of a group.
+
+Matching contracts are processed in chunks of BULK_BATCH_SIZE ids: each
+chunk is read once (only the fields the dashboard rollups depend on), then
+changed with a single update_many or delete_many restricted to those ids,
+and its rollup deltas are written with a single bulk write. When fewer
+contracts than expected are written, some changed or were deleted since the
+chunk was read: the chunk is read again and only the contracts that now hold
+the changes (or are gone) keep their deltas.
+"""
+from bson import ObjectId
+from const import BULK_BATCH_SIZE
+from models.contract import ContractBulkFilter
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from utils import rollups
+
+
+def bulk_query(current_group: dict, filter: ContractBulkFilter) -> dict:
+    """Mongo query of the contracts of the group matching every criterion of filter"""
+    criteria = filter.dict(exclude_none=True)
+    ids = criteria.pop("ids", None)
+    query = {**current_group, **criteria}
+    if ids is not None:
+        query["_id"] = {"$in": ids}
+    return query
+
+
+async def matched_chunks(db: AsyncIOMotorDatabase, query: dict, fields: dict):
+    """
+    Yield the matching contracts, BULK_BATCH_SIZE at a time. The chunks are
+    changed while the cursor is open, which may return a contract again, so
+    each contract is only yielded once.
+    """
+    chunk, seen = [], set()
+    async for contract in db.contracts.find(query, {**rollups.CONTRACT_PROJECTION, **fields},
+                                             batch_size=BULK_BATCH_SIZE):
+        if contract["_id"] in seen:
+            continue
+        seen.add(contract["_id"])
+        chunk.append(contract)
+        if len(chunk) >= BULK_BATCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def chunk_query(query: dict, chunk: list[dict]) -> dict:
+    ids: list[ObjectId] = [contract["_id"] for contract in chunk]
+    return {"$and": [query, {"_id": {"$in": ids}}]}
+
+
+async def bulk_update(db: AsyncIOMotorDatabase, query: dict, changes: dict,
+                      dry_run: bool = False) -> dict:
+    """Set changes on the matching contracts, or only count them when dry_run"""
+    result = {"matched": 0, "modified": 0, "dry_run": dry_run}
+    async for chunk in matched_chunks(db, query, {field: 1 for field in changes}):
+        result["matched"] += len(chunk)
+        changed = [(contract, {**contract, **changes}) for contract in chunk
+                   if any(contract.get(field) != value for field, value in changes.items())]
+        if dry_run:
+            result["modified"] += len(changed)
+            continue
+        update = await db.contracts.update_many(chunk_query(query, chunk), {"$set": changes})
+        result["modified"] += update.modified_count
+        if update.modified_count < len(changed):
+            current = db.contracts.find({"_id": {"$in": [old["_id"] for old, _ in changed]}},
+                                        {field: 1 for field in changes})
+            updated = {contract["_id"] async for contract in current
+                       if all(contract.get(field) == value for field, value in changes.items())}
+            changed = [(old, new) for old, new in changed if old["_id"] in updated]
+        await rollups.apply_changes(db, changed)
+    return result
+
+
+async def bulk_delete(db: AsyncIOMotorDatabase, query: dict, dry_run: bool = False) -> dict:
+    """Delete the matching contracts, or only count them when dry_run"""
+    result = {"matched": 0, "modified": 0, "dry_run": dry_run}
+    async for chunk in matched_chunks(db, query, {}):
+        result["matched"] += len(chunk)
+        if dry_run:
+            result["modified"] += len(chunk)
+            continue
+        delete = await db.contracts.delete_many(chunk_query(query, chunk))
+        result["modified"] += delete.deleted_count
+        if delete.deleted_count < len(chunk):
+            current = db.contracts.find({"_id": {"$in": [contract["_id"] for contract in chunk]}}, {"_id": 1})
+            remaining = {contract["_id"] async for contract in current}
+            chunk = [contract for contract in chunk if contract["_id"] not in remaining]
+        await rollups.apply_changes(db, [(contract, None) for contract in chunk])
+    return result
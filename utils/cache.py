@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Bounded in-process cache whose entries expire after a time-to-live.
+
+    The least recently used entry is evicted once max_size is reached. An entry
+    can also carry a stale window: after it expires it is no longer returned by
+    get, but get_stale still returns it until the window closes, so callers
+    can fall back to it when the source of truth is unavailable.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        # key -> (expires_at, stale_until, value)
+        self._data: OrderedDict[Hashable, tuple[float, float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the fresh value stored for key, or default"""
+        entry = self._data.get(key)
+        now = time.monotonic()
+        if entry is None or entry[0] <= now:
+            if entry is not None and entry[1] <= now:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value stored for key even if expired, while inside its stale window"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return default
+        self.stale_hits += 1
+        return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None, stale_ttl: float = 0) -> None:
+        """Store value for ttl seconds (the cache default if None) plus an optional stale window"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        expires_at = time.monotonic() + ttl
+        self._data[key] = (expires_at, expires_at + max(stale_ttl, 0), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def keys(self) -> list[Hashable]:
+        return list(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits
+        }
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into a single awaited call"""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn(), unless a call for key is already in flight, in which case
+        wait for that call and share its result (or exception).
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+
+            def done(_):
+                if self._calls.get(key) is task:  # not forgotten and started anew
+                    del self._calls[key]
+            task.add_done_callback(done)
+        # shield so a cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def keys(self) -> list[Hashable]:
+        return list(self._calls)
+
+    def forget(self, key: Hashable) -> None:
+        """Let the next call for key start anew, the call in flight still completes for its callers"""
+        self._calls.pop(key, None)
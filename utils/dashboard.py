@@ -0,0 +1,144 @@
+from datetime import datetime
+
+
+ACTIVE = {'contract_status': {'$ne': 'inactive'}}
+INACTIVE = {'contract_status': 'inactive'}
+
+
+def totals_facet(match: dict, field: str | None = None, limit: int | None = None) -> list[dict]:
+    """
+    $facet branch with the quantity and total value of the matching contracts,
+    per value of field (largest total first) or overall when field is None
+    """
+    branch = [
+        {'$match': match},
+        {'$group': {'_id': f'${field}' if field else None,
+                    'quantity': {'$sum': 1}, 'total_value': {'$sum': '$value'}}}
+    ]
+    if field:
+        branch.append({'$sort': {'total_value': -1, '_id': 1}})
+    if limit is not None:
+        branch.append({'$limit': limit})
+    return branch
+
+
+def monthly_pipeline(current_group: dict, type: str, date_filter: datetime, date_filter_next: datetime,
+                     top: int = 10) -> list[dict]:
+    """
+    Monthly dashboard in one round trip. Reads the active contracts of the
+    given type that are current during the month starting at date_filter,
+    plus every inactive contract of the group, and returns a single document
+    of per-facet totals: totals, by_category and by_responsible (the top
+    largest), by_periodicity and inactive.
+    """
+    return [
+        {
+            '$match': {
+                '$and': [
+                    current_group,
+                    {
+                        '$or': [
+                            INACTIVE, {
+                                **ACTIVE,
+                                'type': type,
+                                'effective_date': {'$lt': date_filter_next},
+                                'due_date': {'$gte': date_filter}
+                            }
+                        ]
+                    }
+                ]
+            }
+        }, {
+            '$project': {
+                '_id': 0,
+                'value': 1,
+                'contract_status': 1,
+                'periodicity': 1,
+                'category': 1,
+                'responsible': 1
+            }
+        }, {
+            '$facet': {
+                'totals': totals_facet(ACTIVE),
+                'by_category': totals_facet(ACTIVE, 'category', top),
+                'by_responsible': totals_facet(ACTIVE, 'responsible', top),
+                'by_periodicity': totals_facet(ACTIVE, 'periodicity'),
+                'inactive': totals_facet(INACTIVE)
+            }
+        }
+    ]
+
+
+def annual_pipeline(current_group: dict, type: str, date_filter_start: datetime, date_filter_end: datetime,
+                    range_bounds: list[int]) -> list[dict]:
+    """
+    Annual dashboard in one round trip. Totals the active contracts of the
+    given type that became effective from date_filter_start up to, but not
+    including, date_filter_end by year, by month, by periodicity and by value
+    range. range_bounds are the increasing lower bounds of the value ranges,
+    compared with the value rounded up; lower values fall in the 'below' bucket.
+    """
+    totals = {'quantity': {'$sum': 1}, 'total_value': {'$sum': '$value'}}
+    return [
+        {
+            '$match': {
+                '$and': [
+                    current_group,
+                    {
+                        'contract_status': 'active'
+                    }, {
+                        'effective_date': {
+                            '$lt': date_filter_end
+                        }
+                    }, {
+                        'effective_date': {
+                            '$gte': date_filter_start
+                        }
+                    }, {
+                        'type': type
+                    }
+                ]
+            }
+        }, {
+            '$project': {
+                '_id': 0,
+                'effective_date': 1,
+                'value': 1,
+                'periodicity': 1
+            }
+        }, {
+            '$facet': {
+                'by_year': [
+                    {'$group': {'_id': {'$year': '$effective_date'}, **totals}}
+                ],
+                'by_month': [
+                    {'$group': {'_id': {'year': {'$year': '$effective_date'},
+                                        'month': {'$month': '$effective_date'}}, **totals}}
+                ],
+                'by_periodicity': [
+                    {'$group': {'_id': '$periodicity', **totals}}
+                ],
+                'by_value_range': [
+                    {
+                        '$bucket': {
+                            'groupBy': {'$ceil': '$value'},
+                            'boundaries': [*range_bounds, float('inf')],
+                            'default': 'below',
+                            'output': {'quantity': {'$sum': 1}}
+                        }
+                    }
+                ]
+            }
+        }
+    ]
+
+
+def value_range_labels(range_bounds: list[int]) -> list[str]:
+    """Labels of the value ranges, e.g. [0, 1001] -> ['0 - 1000', '1001 - inf']"""
+    upper = [f"{bound - 1}" for bound in range_bounds[1:]] + ["inf"]
+    return [f"{low} - {high}" for low, high in zip(range_bounds, upper)]
+
+
+def oldest_query(current_group: dict) -> dict:
+    """Contracts considered when looking for the oldest effective date"""
+    return {**current_group, "contract_status": {"$nin": ["inactive"]}}
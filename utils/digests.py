@@ -0,0 +1,142 @@
+"""
+Precomputed upcoming-due digests backing the alerts endpoint.
+
+The alert_digests collection holds one document per group with the rows of
+its active contracts due within ALERT_DIGEST["days"] days, closest due date
+first, as computed on a given date for a given data version of the group.
+A digest is only used on that date and while the group's data version is
+unchanged, so it can never serve stale rows; otherwise the alerts are
+computed live. Digests are refreshed by a job run by one worker once per
+ALERT_DIGEST["interval"] and, a few seconds after each write, for the group
+that changed.
+"""
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from const import ALERT_DIGEST
+from models.pagination import PageParams
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+from utils import response_cache
+from utils.functions import (CONTRACT_OVERVIEW_PROJECTION, MS_PER_DAY,
+                             alerts_query, contracts_pipeline)
+from utils.pagination import split_page
+
+logger = logging.getLogger(__name__)
+
+_refreshes: dict[tuple[str, str], asyncio.Task] = {}
+
+
+def digest_cutoff(day: date) -> datetime:
+    """
+    Due dates covered by a digest computed on day: the alerts asked for at
+    any time of that day, for up to ALERT_DIGEST["days"] days, are due before
+    the end of that day plus the window and a day.
+    """
+    return datetime(day.year, day.month, day.day) + timedelta(days=ALERT_DIGEST["days"] + 2)
+
+
+async def refresh_digest(db: AsyncIOMotorDatabase, group: dict) -> dict:
+    """Recompute the digest of a group, returns its summary"""
+    group = response_cache.group_query(group)
+    # read the version first, a write during the computation makes the digest stale
+    version = await response_cache.get_version(db, group)
+    today = date.today()
+    page = PageParams(limit=ALERT_DIGEST["max_rows"], sort="due_date")
+    pipeline = contracts_pipeline(alerts_query(group, digest_cutoff(today)), page)
+    rows = await db.contracts.aggregate(pipeline).to_list(None)
+    complete = len(rows) <= ALERT_DIGEST["max_rows"]
+    digest = {
+        **group,
+        "date": today.isoformat(),
+        "version": version,
+        "computed_at": datetime.utcnow(),
+        "complete": complete,
+        "rows": rows if complete else []
+    }
+    await db.alert_digests.replace_one(group, digest, upsert=True)
+    return {"rows": len(rows), "complete": complete}
+
+
+async def read_alerts(db: AsyncIOMotorDatabase, group: dict, today: datetime, days_filter: int,
+                      page: PageParams) -> tuple[list[dict], str | None] | None:
+    """
+    The page of alerts served from the group's digest, or None when there is
+    no usable digest for today, the current data version and days_filter
+    """
+    if days_filter > ALERT_DIGEST["days"]:
+        return None
+    digest = await db.alert_digests.find_one(response_cache.group_query(group))
+    if (digest is None or not digest["complete"] or digest["date"] != today.date().isoformat()
+            or digest["version"] != await response_cache.get_version(db, group)):
+        return None
+    due_before = today + timedelta(days=days_filter + 1)
+    rows = [row for row in digest["rows"] if row["due_date"] < due_before]
+    if page.after:
+        after = (page.after["due_date"], page.after["_id"])
+        rows = [row for row in rows if (row["due_date"], row["_id"]) > after]
+    if page.limit:
+        rows = rows[:page.limit + 1]
+    rows, next_cursor = split_page(rows, page)
+    fields = set(CONTRACT_OVERVIEW_PROJECTION)
+    for row in rows:
+        for field in set(row) - fields:
+            del row[field]
+        row["days_until_due_date"] = (row["due_date"] - today) // timedelta(milliseconds=MS_PER_DAY)
+    return rows, next_cursor
+
+
+async def refresh_stale_digests(db: AsyncIOMotorDatabase) -> dict:
+    """Job refreshing every group's digest that is not from today or not of its current version"""
+    report = {"groups": 0, "refreshed": 0, "incomplete": 0}
+    today = date.today().isoformat()
+    pipeline = [
+        {"$match": {"contract_status": "active"}},
+        {"$group": {"_id": {"group_code": "$group_code", "dealer_code": "$dealer_code"}}}
+    ]
+    async for row in db.contracts.aggregate(pipeline):
+        group = row["_id"]
+        report["groups"] += 1
+        digest = await db.alert_digests.find_one(group, {"date": 1, "version": 1})
+        if (digest is not None and digest["date"] == today
+                and digest["version"] == await response_cache.get_version(db, group)):
+            continue
+        summary = await refresh_digest(db, group)
+        report["refreshed"] += 1
+        report["incomplete"] += not summary["complete"]
+    return report
+
+
+async def _delayed_refresh(db: AsyncIOMotorDatabase, group: dict) -> None:
+    key = (group["group_code"], group["dealer_code"])
+    try:
+        await asyncio.sleep(ALERT_DIGEST["debounce"])
+    finally:
+        # from here on, a new write schedules a new refresh
+        if _refreshes.get(key) is asyncio.current_task():
+            del _refreshes[key]
+    try:
+        await refresh_digest(db, group)
+    except PyMongoError as ex:
+        logger.warning("Could not refresh the alert digest of %s: %s", key, ex)
+    except Exception:  # nobody awaits this task, its exception would be lost
+        logger.exception("Could not refresh the alert digest of %s", key)
+
+
+def schedule_refresh(db: AsyncIOMotorDatabase, group: dict) -> None:
+    """
+    Refresh the group's digest shortly, once for a burst of writes. Listener
+    of response_cache.mark_group_changed.
+    """
+    key = (group["group_code"], group["dealer_code"])
+    if key not in _refreshes:
+        _refreshes[key] = asyncio.create_task(_delayed_refresh(db, response_cache.group_query(group)))
+
+
+async def cancel_refreshes() -> None:
+    """Cancel the pending refreshes, on shutdown"""
+    tasks = list(_refreshes.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
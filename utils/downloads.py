@@ -0,0 +1,70 @@
+"""
+Presigned download URLs of the files linked to contracts.
+
+Signing is done for every file of every listing, so the URL of each object
+is cached per worker for FILE_DOWNLOADS["cache_ttl"] seconds, less than the
+URL expiry: a cached URL is never handed out after it has expired, and
+always has at least the difference left.
+"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from const import FILE_DOWNLOADS
+from fastapi.concurrency import run_in_threadpool
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from storage import Storage
+from utils.cache import TTLCache
+
+url_cache = TTLCache(FILE_DOWNLOADS["max_size"],
+                     min(FILE_DOWNLOADS["cache_ttl"], FILE_DOWNLOADS["expiry"]))
+
+
+def sign_urls(storage: Storage, files: list[dict]) -> list[str]:
+    return [storage.presigned_get(file["path"], file["filename"], FILE_DOWNLOADS["expiry"])
+            for file in files]
+
+
+async def download_urls(storage: Storage, files: list[dict]) -> dict[str, tuple[str, datetime]]:
+    """
+    Presigned URL and expiration of each file by path, from the cache when
+    possible. The missing URLs are signed in the threadpool: signing may
+    first resolve the credentials (IMDS/STS requests).
+    """
+    urls = {file["path"]: url_cache.get(file["path"]) for file in files}
+    missing = [file for file in files if urls[file["path"]] is None]
+    if missing:
+        expires_at = datetime.utcnow() + timedelta(seconds=FILE_DOWNLOADS["expiry"])
+        signed = await run_in_threadpool(sign_urls, storage, missing)
+        for file, url in zip(missing, signed):
+            urls[file["path"]] = (url, expires_at)
+            url_cache.set(file["path"], (url, expires_at))
+    return urls
+
+
+async def contract_downloads(db: AsyncIOMotorDatabase, storage: Storage, current_group: dict,
+                             contract_ids: list[ObjectId]) -> list[dict]:
+    """
+    Download of every file linked to each contract of the group, in the
+    order of contract_ids then of linking. Unknown contracts are skipped.
+    """
+    contracts = db.contracts.find({**current_group, "_id": {"$in": contract_ids}}, {"_id": 1})
+    found = [contract["_id"] async for contract in contracts]
+    files = db.files.find({"contract_id": {"$in": found}},
+                          {"contract_id": 1, "path": 1, "filename": 1, "size": 1}).sort("_id", 1)
+    files_by_contract: dict[ObjectId, list[dict]] = {}
+    async for file in files:
+        files_by_contract.setdefault(file["contract_id"], []).append(file)
+    urls = await download_urls(storage, [file for files in files_by_contract.values() for file in files])
+    downloads = []
+    for contract_id in dict.fromkeys(contract_ids):
+        for file in files_by_contract.get(contract_id, []):
+            url, expires_at = urls[file["path"]]
+            downloads.append({
+                "contract_id": contract_id,
+                "path": file["path"],
+                "filename": file["filename"],
+                "size": file.get("size"),
+                "url": url,
+                "expires_at": expires_at
+            })
+    return downloads
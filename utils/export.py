@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Literal
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCommandCursor
+
+ExportFormat = Literal["ndjson", "csv"]
+
+# columns of every export, in order, followed by the group's extra fields
+EXPORT_COLUMNS = ["_id", "contractor_name", "category_id", "category", "periodicity",
+                  "due_date", "type", "value", "effective_date", "responsible_id",
+                  "responsible", "contract_status"]
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+# flush the output buffer once it grows past this many characters
+CHUNK_SIZE = 64 * 1024
+
+
+def export_value(value):
+    """Convert a BSON value into its plain text representation"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def stream_rows(cursor: AsyncIOMotorCommandCursor, columns: list[str],
+                      format: ExportFormat) -> AsyncIterator[str]:
+    """
+    Serialize the rows of cursor one at a time, yielding chunks of about
+    CHUNK_SIZE characters so memory stays constant regardless of row count.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(columns)
+    async for row in cursor:
+        if format == "csv":
+            writer.writerow([export_value(row.get(column, "")) for column in columns])
+        else:
+            buffer.write(json.dumps({column: export_value(row[column])
+                                     for column in columns if column in row}))
+            buffer.write("\n")
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -1,72 +1,237 @@
+import re
+from datetime import datetime
+
+from bson import ObjectId
 from dateutil.relativedelta import relativedelta
 from models.contract import ContractIn, ContractOverview
-from pymongo.database import Database
+from models.pagination import PageParams
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from utils import references
+from utils.pagination import cursor_fields, paging_stages, split_page
+from utils.search import normalize, search_fields
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+# months in each contract period
+periodicity_table = {
+    "monthly": 1,
+    "bimonthly": 2,
+    "quarterly": 3,
+    "biannually": 6,
+    "annually": 12
+}
+GROUP_KEYS = {'_id', 'group_code', 'dealer_code'}
+# internal fields a contract details response never needs
+DETAILS_PROJECTION = {'search_key': 0, 'search_tokens': 0}
 
+CONTRACT_OVERVIEW_PROJECTION = {
+    '_id': 1,
+    'group_code': 1,
+    'dealer_code': 1,
+    'contractor_name': 1,
+    'category_id': 1,
+    'category': 1,
+    'periodicity': 1,
+    'due_date': 1,
+    'type': 1,
+    'value': 1,
+    'effective_date': 1,
+    'responsible_id': 1,
+    'responsible': 1,
+    'contract_status': 1
+}
 
-def retrieve_contracts(db: Database, query: dict) -> list[ContractOverview]:
+
+def contracts_pipeline(query: dict, page: PageParams | None = None,
+                       extra_fields: list[str] | None = None) -> list[dict]:
+    """
+    Aggregation returning ContractOverview rows for the query. Category and
+    responsible names are stored on the contract, so no join is needed. With a
+    page, the cursor, sort and limit are applied and only the requested fields
+    are projected. extra_fields adds the given contract field codes to the projection.
+    """
     pipeline = [
         {
             '$match': query
-        }, {
-            '$lookup': {
-                'from': 'responsibles',
-                'localField': 'responsible_id',
-                'foreignField': '_id',
-                'as': 'responsible_obj'
+        }
+    ]
+    if page is not None:
+        pipeline.extend(paging_stages(page))
+    pipeline.append({
+        '$project': overview_projection(page, extra_fields)
+    })
+    return pipeline
+
+
+def overview_projection(page: PageParams | None = None, extra_fields: list[str] | None = None) -> dict:
+    """$project body of the overview rows, trimmed to the fields requested by page"""
+    projection = CONTRACT_OVERVIEW_PROJECTION
+    if page is not None and page.fields:
+        projection = {
+            '_id': 1,
+            **{field: CONTRACT_OVERVIEW_PROJECTION[field] for field in page.fields}
+        }
+    if page is not None:
+        # the fields of the next cursor must be available
+        projection = {**projection, **{field: 1 for field in cursor_fields(page.sort)
+                                       if field not in projection}}
+    if extra_fields:
+        projection = {**projection, **{field: 1 for field in extra_fields}}
+    return projection
+
+
+def search_pipeline(current_group: dict, query: str, page: PageParams) -> list[dict]:
+    """
+    Contracts of the group with a word starting with each word of the query,
+    most relevant first: exact name, then name prefix, then whole-word
+    matches, then word prefixes. Ties are ordered by name.
+    """
+    key = normalize(query)
+    tokens = key.split()
+    prefix = f"^{re.escape(key)}"
+    pipeline = [
+        {
+            '$match': {
+                '$and': [
+                    current_group,
+                    *[{'search_tokens': re.compile(f"^{re.escape(token)}")} for token in tokens]
+                ]
             }
         }, {
-            '$unwind': {
-                'path': '$responsible_obj'
+            '$addFields': {
+                'score': {
+                    '$switch': {
+                        'branches': [
+                            {'case': {'$eq': ['$search_key', key]}, 'then': 3},
+                            {'case': {'$regexMatch': {'input': '$search_key', 'regex': prefix}}, 'then': 2},
+                            {'case': {'$setIsSubset': [tokens, '$search_tokens']}, 'then': 1}
+                        ],
+                        'default': 0
+                    }
+                }
             }
-        }, {
-            '$lookup': {
-                'from': 'categories',
-                'localField': 'category_id',
-                'foreignField': '_id',
-                'as': 'category_obj'
+        }
+    ]
+    if page.after:
+        score, search_key = page.after['score'], page.after['search_key']
+        pipeline.append({
+            '$match': {
+                '$or': [
+                    {'score': {'$lt': score}},
+                    {'score': score, 'search_key': {'$gt': search_key}},
+                    {'score': score, 'search_key': search_key, '_id': {'$gt': page.after['_id']}}
+                ]
             }
+        })
+    pipeline.extend([
+        {
+            '$sort': {'score': -1, 'search_key': 1, '_id': 1}
         }, {
-            '$unwind': {
-                'path': '$category_obj'
-            }
+            '$limit': page.limit + 1
         }, {
-            '$project': {
-                '_id': 1,
-                'group_code': 1,
-                'dealer_code': 1,
-                'contractor_name': 1,
-                'category_id': 1,
-                'category': '$category_obj.name',
-                'periodicity': 1,
-                'due_date': 1,
-                'type': 1,
-                'value': 1,
-                'effective_date': 1,
-                'responsible_id': 1,
-                'responsible': '$responsible_obj.name',
-                'contract_status': 1
+            '$project': overview_projection(page)
+        }
+    ])
+    return pipeline
+
+
+def alerts_query(current_group: dict, due_before: datetime) -> dict:
+    """Active contracts of the group that are due before the given date"""
+    return {"$and": [
+        current_group,
+        {"due_date": {"$lt": due_before}},
+        {"contract_status": "active"}
+    ]}
+
+
+def alerts_pipeline(current_group: dict, today: datetime, days_filter: int,
+                    page: PageParams) -> list[dict]:
+    """
+    Page of the contracts due within days_filter days of today, closest due
+    date first, with the whole days left until the due date as
+    days_until_due_date (negative once overdue)
+    """
+    due_before = today + relativedelta(days=days_filter+1)
+    pipeline = contracts_pipeline(alerts_query(current_group, due_before), page)
+    pipeline.append({
+        '$addFields': {
+            'days_until_due_date': {
+                '$floor': {
+                    '$divide': [{'$subtract': ['$due_date', today]}, MS_PER_DAY]
+                }
             }
         }
+    })
+    return pipeline
+
+
+def contract_details(contract: dict, contract_fields: dict[str, dict]) -> dict:
+    """
+    ContractDetails of a contract document. Every key of the contract that is
+    a contract field of its group becomes an extra field, with the field's
+    definition and the stored value.
+    """
+    extra_fields = [
+        {**{k: v for k, v in contract_fields[key].items() if k not in GROUP_KEYS},
+         'field_value': value}
+        for key, value in contract.items() if key in contract_fields and key not in GROUP_KEYS
     ]
-    result = db.contracts.aggregate(pipeline)
-    return [ContractOverview(**contract) for contract in list(result)]
+    return {**contract, 'extra_fields': extra_fields}
+
+
+async def retrieve_contract_details(db: AsyncIOMotorDatabase, current_group: dict,
+                                    ids: list[ObjectId]) -> list[dict]:
+    """
+    Details of the contracts of the group with the given ids, in the order of
+    ids, in a single query. Field definitions come from the reference cache.
+    """
+    contracts = {contract['_id']: contract async for contract in
+                 db.contracts.find({**current_group, '_id': {'$in': ids}}, DETAILS_PROJECTION)}
+    if not contracts:
+        return []
+    contract_fields = await references.get_contract_fields(db, current_group)
+    return [contract_details(contracts[id], contract_fields) for id in ids if id in contracts]
 
 
-def build_contract_data(contract_in: ContractIn, current_group: dict = {}) -> dict:
+async def retrieve_contracts(db: AsyncIOMotorDatabase, query: dict) -> list[ContractOverview]:
+    result = db.contracts.aggregate(contracts_pipeline(query))
+    return [ContractOverview(**contract) async for contract in result]
+
+
+async def retrieve_contract_page(db: AsyncIOMotorDatabase, query: dict,
+                                 page: PageParams) -> tuple[list[dict], str | None]:
+    """Return one page of contract rows for the query and the cursor of the next page"""
+    return await aggregate_page(db, contracts_pipeline(query, page), page)
+
+
+async def aggregate_page(db: AsyncIOMotorDatabase, pipeline: list[dict],
+                         page: PageParams) -> tuple[list[dict], str | None]:
+    """
+    Run a contracts pipeline built with page and return the rows of the page
+    and the cursor of the next one
+    """
+    rows = await db.contracts.aggregate(pipeline).to_list(None)
+    rows, next_cursor = split_page(rows, page)
+    # drop the fields that were only projected to build the cursor
+    requested = page.fields or CONTRACT_OVERVIEW_PROJECTION
+    hidden = [field for field in cursor_fields(page.sort)
+              if field not in requested and field != '_id']
+    for row in rows:
+        for field in hidden:
+            row.pop(field, None)
+    return rows, next_cursor
+
+
+def build_contract_data(contract_in: ContractIn, current_group: dict = {}, references: dict = {}) -> dict:
     """
     Takes a ContractIn model and flattens the data into a dict so it can be
-    inserted into the database.
+    inserted into the database. references holds the denormalized category
+    and responsible names.
     """
     contract_data = {
         **current_group,
-        **contract_in.dict(exclude={"extra_fields"})
-    }
-    periodicity_table = {
-        "monthly": 1,
-        "bimonthly": 2,
-        "quarterly": 3,
-        "biannually": 6,
-        "annually": 12
+        **contract_in.dict(exclude={"extra_fields"}),
+        **references,
+        **search_fields(contract_in.contractor_name)
     }
     due_date = contract_in.effective_date + \
         relativedelta(months=periodicity_table[contract_in.periodicity])
@@ -79,3 +244,22 @@ def build_contract_data(contract_in: ContractIn, current_group: dict = {}) -> di
             field.field_code: field.details.field_value for field in contract_in.extra_fields}
         contract_data.update(extra_fields)
     return contract_data
+
+
+async def backfill_reference_names(db: AsyncIOMotorDatabase) -> dict:
+    """
+    Copy the current category and responsible names onto every contract that
+    references them. Safe to run repeatedly.
+    """
+    report = {}
+    for collection, field in (("categories", "category"), ("responsibles", "responsible")):
+        matched = modified = 0
+        async for reference in db[collection].find({}, {"name": 1}):
+            result = await db.contracts.update_many(
+                {f"{field}_id": reference["_id"], field: {"$ne": reference["name"]}},
+                {"$set": {field: reference["name"]}}
+            )
+            matched += result.matched_count
+            modified += result.modified_count
+        report[field] = {"matched": matched, "modified": modified}
+    return report
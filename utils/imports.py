@@ -0,0 +1,119 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from typing import BinaryIO, Iterator
+
+from bson import ObjectId
+from models.contract import ContractIn
+from pydantic import ValidationError
+from utils.export import ExportFormat
+from utils.functions import build_contract_data
+
+# columns that are ignored on import, e.g. when re-importing an export
+IGNORED_COLUMNS = {"_id", "due_date", "group_code", "dealer_code"}
+
+
+def read_rows(file: BinaryIO, format: ExportFormat) -> Iterator[dict]:
+    """
+    Iterate over the rows of an uploaded CSV (with a header row) or NDJSON
+    file one at a time. Blank lines and empty CSV cells are skipped, a row
+    that can not be parsed is yielded as a ValueError.
+    """
+    # not an io.TextIOWrapper: the upload may be a SpooledTemporaryFile,
+    # which before Python 3.11 is not a full io object (no readable()). Nor a
+    # codecs reader, which also splits lines on \x0c, U+2028 and the like:
+    # the file's own \n separated lines are decoded one by one instead
+    text = codecs.iterdecode(file, "utf-8-sig")
+    if format == "csv":
+        for row in csv.DictReader(text):
+            yield {column: value for column, value in row.items()
+                   if column is not None and value not in ("", None)}
+    else:
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield ValueError("Invalid JSON")
+                continue
+            yield row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+
+class ContractImporter:
+    """
+    Turns imported rows into contract documents of a group. Category and
+    responsible are resolved from the given reference documents, by id or,
+    when no id is given, by name. Columns named after a contract field of the
+    group become extra fields.
+    """
+
+    def __init__(self, current_group: dict, categories: dict, responsibles: dict,
+                 contract_fields: dict):
+        self.current_group = current_group
+        self.categories = categories
+        self.responsibles = responsibles
+        self.category_names = {category["name"]: id for id, category in categories.items()}
+        self.responsible_names = {responsible["name"]: id for id, responsible in responsibles.items()}
+        self.contract_fields = contract_fields
+
+    def resolve(self, row: dict, field: str, documents: dict, names: dict) -> ObjectId:
+        id = row.get(f"{field}_id")
+        if id is None:
+            if not isinstance(row.get(field), str) or row[field] not in names:
+                raise ValueError(f"Invalid {field}")
+            return names[row[field]]
+        if not isinstance(id, str) or not ObjectId.is_valid(id) or ObjectId(id) not in documents:
+            raise ValueError(f"Invalid {field}")
+        return ObjectId(id)
+
+    def build(self, row: dict) -> dict:
+        """Contract document of a row, raises ValueError or ValidationError"""
+        data = {key: value for key, value in row.items()
+                if key not in IGNORED_COLUMNS and key not in self.contract_fields}
+        category_id = self.resolve(row, "category", self.categories, self.category_names)
+        responsible_id = self.resolve(row, "responsible", self.responsibles, self.responsible_names)
+        extra_fields = data.pop("extra_fields", None) or []
+        if not isinstance(extra_fields, list):
+            raise ValueError("Invalid extra_fields")
+        extra_fields = extra_fields + [
+            {"field_code": code, "details": {"field_type": field["field_type"], "field_value": row[code]}}
+            for code, field in self.contract_fields.items() if code in row
+        ]
+        contract = ContractIn(**{**data, "category_id": category_id,
+                                 "responsible_id": responsible_id,
+                                 "extra_fields": extra_fields or None})
+        return build_contract_data(contract, self.current_group, {
+            "category": self.categories[category_id]["name"],
+            "responsible": self.responsibles[responsible_id]["name"]
+        })
+
+
+def row_errors(ex: Exception) -> list[str]:
+    """Readable messages of a row validation failure"""
+    if isinstance(ex, ValidationError):
+        return [f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                for error in ex.errors()]
+    return [str(ex)]
+
+
+def build_batch(rows: Iterator[dict], importer: ContractImporter, first_row: int,
+                batch_size: int) -> tuple[list[tuple[int, dict]], list[dict], int]:
+    """
+    Read and validate up to batch_size rows. Returns the (row number,
+    document) pairs to insert, the error report of the invalid rows and the
+    number of rows read, which is 0 at the end of the file. Rows are numbered
+    from 1, not counting the CSV header. Errors reading the file itself
+    (UnicodeDecodeError, csv.Error) are raised.
+    """
+    documents, errors, count = [], [], 0
+    for count, row in enumerate(islice(rows, batch_size), 1):
+        number = first_row + count - 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            documents.append((number, importer.build(row)))
+        except ValueError as ex:  # pydantic's ValidationError included
+            errors.append({"row": number, "errors": row_errors(ex)})
+    return documents, errors, count
@@ -0,0 +1,83 @@
+import base64
+
+from bson import json_util
+from models.pagination import PageParams
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# row fields stored in the cursor of each sort, _id always breaks ties
+CURSOR_FIELDS = {
+    "_id": ["_id"],
+    "due_date": ["due_date", "_id"],
+    "relevance": ["score", "search_key", "_id"]
+}
+
+
+def cursor_fields(sort: str) -> list[str]:
+    return CURSOR_FIELDS[sort.lstrip("-")]
+
+
+def encode_cursor(sort: str, row: dict) -> str:
+    """Build an opaque cursor pointing right after row for the given sort"""
+    payload = {"sort": sort, **{field: row[field] for field in cursor_fields(sort)}}
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Inverse of encode_cursor
+
+    Raises:
+        ValueError: The cursor is malformed
+    """
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or not isinstance(payload.get("sort"), str) \
+            or payload["sort"].lstrip("-") not in CURSOR_FIELDS:
+        raise ValueError("Invalid cursor")
+    if any(field not in payload for field in cursor_fields(payload["sort"])):
+        raise ValueError("Invalid cursor")
+    return payload
+
+
+def sort_spec(sort: str) -> dict:
+    """$sort stage body for the sort option, using _id as tie breaker"""
+    direction = -1 if sort.startswith("-") else 1
+    return {sort.lstrip("-"): direction, "_id": direction}
+
+
+def keyset_filter(sort: str, after: dict) -> dict:
+    """Query matching the rows that come after the cursor for the given sort"""
+    op = "$lt" if sort.startswith("-") else "$gt"
+    key = sort.lstrip("-")
+    if key == "_id":
+        return {"_id": {op: after["_id"]}}
+    return {
+        "$or": [
+            {key: {op: after[key]}},
+            {key: after[key], "_id": {op: after["_id"]}}
+        ]
+    }
+
+
+def paging_stages(page: PageParams) -> list[dict]:
+    """
+    Pipeline stages applying the cursor, sort and limit of page. One extra row
+    is requested so the caller can tell whether there is a next page.
+    """
+    stages = []
+    if page.after:
+        stages.append({"$match": keyset_filter(page.sort, page.after)})
+    stages.append({"$sort": sort_spec(page.sort)})
+    if page.limit:
+        stages.append({"$limit": page.limit + 1})
+    return stages
+
+
+def split_page(rows: list[dict], page: PageParams) -> tuple[list[dict], str | None]:
+    """Drop the look-ahead row and return the rows along with the next cursor, if any"""
+    if not page.limit or len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, encode_cursor(page.sort, rows[-1])
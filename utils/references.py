@@ -0,0 +1,130 @@
+"""
+Per-worker cache of the small reference collections (categories,
+responsibles and contract_fields), loaded one whole group at a time.
+
+Entries expire after REFERENCE_CACHE["ttl"] seconds. The routes that write
+these collections invalidate the group right away, and a change stream
+watcher invalidates the other workers' copies. Invalidating bumps the
+generation of the group, a load started before that is still returned to
+its callers but not cached.
+"""
+import asyncio
+import logging
+
+from bson import ObjectId
+from const import REFERENCE_CACHE
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+from utils.cache import SingleFlight, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# collection -> field the cached documents are keyed by
+KEY_FIELDS = {
+    "categories": "_id",
+    "responsibles": "_id",
+    "contract_fields": "field_code"
+}
+
+reference_cache = TTLCache(REFERENCE_CACHE["max_size"], REFERENCE_CACHE["ttl"])
+_loads = SingleFlight()
+# collection or cache key -> number of invalidations
+_generations: dict[str | tuple, int] = {}
+_watcher: asyncio.Task | None = None
+
+
+def _cache_key(collection: str, group: dict) -> tuple[str, str, str]:
+    return (collection, group["group_code"], group["dealer_code"])
+
+
+def _generation(key: tuple[str, str, str]) -> tuple[int, int]:
+    return (_generations.get(key[0], 0), _generations.get(key, 0))
+
+
+async def get_references(db: AsyncIOMotorDatabase, collection: str, group: dict) -> dict:
+    """
+    Return every document of collection for the group, keyed by KEY_FIELDS.
+    The documents are shared between requests and must not be modified.
+    """
+    key = _cache_key(collection, group)
+    documents = reference_cache.get(key)
+    if documents is not None:
+        return documents
+
+    async def load() -> dict:
+        generation = _generation(key)
+        query = {"group_code": group["group_code"], "dealer_code": group["dealer_code"]}
+        documents = {document[KEY_FIELDS[collection]]: document
+                     async for document in db[collection].find(query)}
+        if _generation(key) == generation:
+            reference_cache.set(key, documents)
+        return documents
+    return await _loads.do(key, load)
+
+
+async def get_categories(db: AsyncIOMotorDatabase, group: dict) -> dict[ObjectId, dict]:
+    return await get_references(db, "categories", group)
+
+
+async def get_responsibles(db: AsyncIOMotorDatabase, group: dict) -> dict[ObjectId, dict]:
+    return await get_references(db, "responsibles", group)
+
+
+async def get_contract_fields(db: AsyncIOMotorDatabase, group: dict) -> dict[str, dict]:
+    return await get_references(db, "contract_fields", group)
+
+
+def invalidate(collection: str, group: dict | None = None) -> None:
+    """Drop the cached documents of a group, or of every group when none is given"""
+    if group is not None:
+        key = _cache_key(collection, group)
+        _generations[key] = _generations.get(key, 0) + 1
+        reference_cache.delete(key)
+        _loads.forget(key)
+        return
+    _generations[collection] = _generations.get(collection, 0) + 1
+    for key in [key for key in reference_cache.keys() if key[0] == collection]:
+        reference_cache.delete(key)
+    for key in [key for key in _loads.keys() if key[0] == collection]:
+        _loads.forget(key)
+
+
+async def watch_references(db: AsyncIOMotorDatabase) -> None:
+    """Invalidate cached groups as the reference collections change in any worker"""
+    pipeline = [{"$match": {"ns.coll": {"$in": list(KEY_FIELDS)}}}]
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                async for change in stream:
+                    document = change.get("fullDocument") or {}
+                    collection = change["ns"]["coll"]
+                    if "group_code" in document and "dealer_code" in document:
+                        invalidate(collection, document)
+                    else:  # deletes do not carry the document
+                        invalidate(collection)
+        except OperationFailure as ex:
+            # e.g. a standalone server, change streams need a replica set
+            logger.warning("Reference change stream unavailable, relying on TTL: %s", ex)
+            return
+        except PyMongoError as ex:
+            logger.warning("Reference change stream interrupted: %s", ex)
+            for collection in KEY_FIELDS:
+                invalidate(collection)
+            await asyncio.sleep(REFERENCE_CACHE["watch_retry"])
+
+
+def start_watcher(db: AsyncIOMotorDatabase) -> None:
+    global _watcher
+    if _watcher is None:
+        _watcher = asyncio.create_task(watch_references(db))
+
+
+async def stop_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
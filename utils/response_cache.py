@@ -0,0 +1,162 @@
+"""
+Response cache of the polled read endpoints (dashboards and alerts).
+
+Every group has a data version in the data_versions collection, bumped by
+mark_group_changed on each contract, category and responsible write. A
+cached response is keyed by the path, the group, the query string, the
+current date and that version, so a write makes the group's previous
+entries unreachable instead of having to find and delete them. The ETag is
+derived from the same key: a client presenting it gets a 304 without the
+response being computed or even read from the cache.
+
+The backend is an in-process LRU, or a Redis store shared by the workers
+when RESPONSE_CACHE["redis_url"] is set and the redis package is installed.
+"""
+import hashlib
+import json
+import logging
+from datetime import date
+from typing import Any, Callable
+
+from const import RESPONSE_CACHE
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import parse_obj_as
+from pymongo.errors import PyMongoError
+from utils.cache import TTLCache
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional, the in-process backend is used without it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Per-worker LRU of the cached responses"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.cache = TTLCache(max_size, ttl)
+
+    async def get(self, key: str) -> dict | None:
+        return self.cache.get(key)
+
+    async def set(self, key: str, entry: dict) -> None:
+        self.cache.set(key, entry)
+
+
+class RedisBackend:
+    """Cached responses shared by every worker through Redis"""
+
+    def __init__(self, url: str, ttl: float):
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str) -> dict | None:
+        value = await self.client.get(f"contrack:response:{key}")
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, entry: dict) -> None:
+        await self.client.set(f"contrack:response:{key}", json.dumps(entry), ex=int(self.ttl))
+
+
+def create_backend() -> MemoryBackend | RedisBackend:
+    if RESPONSE_CACHE["redis_url"] and redis is not None:
+        return RedisBackend(RESPONSE_CACHE["redis_url"], RESPONSE_CACHE["ttl"])
+    if RESPONSE_CACHE["redis_url"]:
+        logger.warning("redis is not installed, using the in-process response cache")
+    return MemoryBackend(RESPONSE_CACHE["max_size"], RESPONSE_CACHE["ttl"])
+
+
+backend = create_backend()
+metrics = {"hits": 0, "misses": 0, "not_modified": 0, "errors": 0}
+change_listeners: list[Callable[[AsyncIOMotorDatabase, dict], None]] = []
+
+
+def group_query(group: dict) -> dict:
+    return {"group_code": group["group_code"], "dealer_code": group["dealer_code"]}
+
+
+async def get_version(db: AsyncIOMotorDatabase, group: dict) -> int:
+    document = await db.data_versions.find_one(group_query(group), {"version": 1})
+    return document["version"] if document else 0
+
+
+async def mark_group_changed(db: AsyncIOMotorDatabase, group: dict) -> None:
+    """
+    Bump the data version of the group, making its cached responses stale,
+    and notify the change listeners
+    """
+    try:
+        await db.data_versions.update_one(group_query(group), {"$inc": {"version": 1}}, upsert=True)
+    except PyMongoError as ex:
+        logger.error("Could not bump the data version of %s: %s", group_query(group), ex)
+    for listener in change_listeners:
+        listener(db, group)
+
+
+def add_change_listener(listener: Callable[[AsyncIOMotorDatabase, dict], None]) -> None:
+    """Call listener(db, group) after each data version bump, it must not block"""
+    if listener not in change_listeners:
+        change_listeners.append(listener)
+
+
+class CachedResponse:
+    """
+    Cache lookup for one request. response is the 304 or the cached response
+    to return when there is one; otherwise the route computes its result and
+    returns store(result).
+    """
+
+    def __init__(self, key: str, response: Response | None = None):
+        self.key = key
+        self.etag = f'"{key}"'
+        self.response = response
+
+    def headers(self, headers: dict | None = None) -> dict:
+        return {**(headers or {}), "ETag": self.etag, "Cache-Control": "private, no-cache"}
+
+    async def store(self, content: Any, model: Any = None, headers: dict | None = None) -> Response:
+        """Serialize content (validated as model when given), cache it and return it"""
+        if model is not None:
+            content = parse_obj_as(model, content)
+        entry = {"body": json.dumps(jsonable_encoder(content)), "headers": headers or {}}
+        try:
+            await backend.set(self.key, entry)
+        except Exception as ex:  # the backend is best effort, e.g. Redis down
+            metrics["errors"] += 1
+            logger.warning("Could not store a cached response: %s", ex)
+        return Response(entry["body"], media_type="application/json", headers=self.headers(headers))
+
+
+async def lookup(request: Request, db: AsyncIOMotorDatabase, group: dict) -> CachedResponse:
+    """Find the cached response of the request for the group's current data version"""
+    version = await get_version(db, group)
+    query = sorted(request.query_params.multi_items())
+    raw_key = json.dumps([request.url.path, group["group_code"], group["dealer_code"], query,
+                          date.today().isoformat(), version])
+    cached = CachedResponse(hashlib.sha256(raw_key.encode()).hexdigest()[:32])
+
+    if cached.etag in request.headers.get("if-none-match", ""):
+        metrics["not_modified"] += 1
+        cached.response = Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cached.headers())
+        return cached
+    try:
+        entry = await backend.get(cached.key)
+    except Exception as ex:
+        metrics["errors"] += 1
+        logger.warning("Could not read a cached response: %s", ex)
+        entry = None
+    if entry is None:
+        metrics["misses"] += 1
+        return cached
+    metrics["hits"] += 1
+    cached.response = Response(entry["body"], media_type="application/json",
+                               headers=cached.headers(entry["headers"]))
+    return cached
+
+
+def stats() -> dict:
+    return {"backend": type(backend).__name__, **metrics}
@@ -0,0 +1,91 @@
+"""
+Due date roll-forward of recurring contracts.
+
+An active contract whose due date has passed is moved to its next due
+date: the first effective_date + k periods (k >= 1) after now. Counting
+from the effective date, rather than adding a period to the old due date,
+keeps the day of the month of the contract (Jan 31 -> Feb 28 -> Mar 31).
+
+Each contract is updated only if its due date is still the one that was
+read, so runs are idempotent and can overlap with contract writes; a run
+that stops halfway is simply resumed by the next one.
+"""
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from utils import response_cache, rollups
+from utils.functions import periodicity_table
+
+
+def next_due_date(effective_date: datetime, periodicity: str, now: datetime) -> datetime:
+    """First effective_date + k periods, k >= 1, that is after now"""
+    period = periodicity_table[periodicity]
+    elapsed = (now.year - effective_date.year) * 12 + now.month - effective_date.month
+    k = max(1, elapsed // period)
+    due_date = effective_date + relativedelta(months=k * period)
+    while due_date <= now:
+        k += 1
+        due_date = effective_date + relativedelta(months=k * period)
+    return due_date
+
+
+def overdue_query(now: datetime, after: dict | None = None) -> dict:
+    """
+    Active contracts whose due date has passed, after the (due_date, _id)
+    of the last contract of the previous batch
+    """
+    query = {"contract_status": "active", "due_date": {"$lte": now}}
+    if after is not None:
+        query["$or"] = [
+            {"due_date": {"$gt": after["due_date"]}},
+            {"due_date": after["due_date"], "_id": {"$gt": after["_id"]}}
+        ]
+    return query
+
+
+async def roll_forward(db: AsyncIOMotorDatabase, batch_size: int,
+                       now: datetime | None = None) -> dict:
+    """
+    Advance every overdue contract, batch_size contracts per bulk write,
+    oldest due date first. Returns the run report.
+    """
+    now = now or datetime.today()
+    report = {"scanned": 0, "advanced": 0, "skipped": 0, "batches": 0}
+    groups = set()
+    after = None
+    while True:
+        contracts = await db.contracts.find(overdue_query(now, after), rollups.CONTRACT_PROJECTION) \
+            .sort([("due_date", 1), ("_id", 1)]).limit(batch_size).to_list(None)
+        if not contracts:
+            break
+        after = contracts[-1]
+        report["scanned"] += len(contracts)
+        report["batches"] += 1
+        operations, changes = [], {}
+        for contract in contracts:
+            if contract.get("periodicity") not in periodicity_table or not contract.get("effective_date"):
+                report["skipped"] += 1
+                continue
+            due_date = next_due_date(contract["effective_date"], contract["periodicity"], now)
+            operations.append(UpdateOne({"_id": contract["_id"], "due_date": contract["due_date"]},
+                                        {"$set": {"due_date": due_date}}))
+            changes[contract["_id"]] = (contract, {**contract, "due_date": due_date})
+        if not operations:
+            continue
+        result = await db.contracts.bulk_write(operations, ordered=False)
+        report["advanced"] += result.modified_count
+        if result.modified_count < len(operations):
+            # some contracts changed since they were read, keep the rollup
+            # deltas of the ones that now have the due date that was set
+            current = db.contracts.find({"_id": {"$in": list(changes)}}, {"due_date": 1})
+            updated = {contract["_id"] async for contract in current
+                       if contract.get("due_date") == changes[contract["_id"]][1]["due_date"]}
+            changes = {id: change for id, change in changes.items() if id in updated}
+        await rollups.apply_changes(db, list(changes.values()))
+        groups.update((old["group_code"], old["dealer_code"]) for old, _ in changes.values())
+    for group_code, dealer_code in groups:
+        await response_cache.mark_group_changed(db, {"group_code": group_code, "dealer_code": dealer_code})
+    report["groups"] = len(groups)
+    return report
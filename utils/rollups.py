@@ -0,0 +1,250 @@
+"""
+Materialized monthly dashboard rollups, kept in the dashboard_rollups collection.
+
+There is one document per (group_code, dealer_code, type, month) holding the
+quantity and total value of the active contracts current during that month,
+bucketed by category, responsible and periodicity. A contract is current
+from the month of its effective date to the month of its due date, inclusive.
+A single group document (type and month set to None) holds the inactive
+totals and whether the rollups of the group have been built.
+
+Contract writes apply the difference between the old and the new version of
+the contract with $inc, so maintaining them never reads the other contracts.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+from utils import references, response_cache
+
+logger = logging.getLogger(__name__)
+
+TOP_BUCKETS = 10
+# contract fields the rollups depend on
+CONTRACT_PROJECTION = {"group_code": 1, "dealer_code": 1, "type": 1, "contract_status": 1,
+                       "value": 1, "effective_date": 1, "due_date": 1, "category_id": 1,
+                       "responsible_id": 1, "periodicity": 1}
+
+# (group_code, dealer_code, type, month) -> field -> increment
+Increments = dict[tuple, dict[str, float]]
+
+
+def month_key(date: datetime) -> str:
+    return f"{date.year:04d}-{date.month:02d}"
+
+
+def contract_months(contract: dict) -> list[str]:
+    """Months during which the contract is current, from effective date to due date"""
+    start, end = contract["effective_date"], contract["due_date"]
+    year, month = start.year, start.month
+    months = []
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def add_contract(increments: Increments, contract: dict, sign: int) -> None:
+    """Accumulate the contribution of a contract, added (1) or removed (-1)"""
+    group = (contract["group_code"], contract["dealer_code"])
+    value = sign * contract["value"]
+    if contract["contract_status"] == "inactive":
+        fields = increments[(*group, None, None)]
+        fields["inactive_quantity"] += sign
+        fields["inactive_total_value"] += value
+        return
+    buckets = {
+        "by_category": str(contract["category_id"]),
+        "by_responsible": str(contract["responsible_id"]),
+        "by_periodicity": contract["periodicity"]
+    }
+    for month in contract_months(contract):
+        fields = increments[(*group, contract["type"], month)]
+        fields["quantity"] += sign
+        fields["total_value"] += value
+        for bucket, key in buckets.items():
+            fields[f"{bucket}.{key}.quantity"] += sign
+            fields[f"{bucket}.{key}.total_value"] += value
+
+
+def new_increments() -> Increments:
+    return defaultdict(lambda: defaultdict(int))
+
+
+def update_operations(increments: Increments) -> list[UpdateOne]:
+    """Upserting $inc updates of the rollup documents, skipping the ones that cancel out"""
+    operations = []
+    for (group_code, dealer_code, type, month), fields in increments.items():
+        fields = {field: value for field, value in fields.items() if value != 0}
+        if fields:
+            operations.append(UpdateOne(
+                {"group_code": group_code, "dealer_code": dealer_code, "type": type, "month": month},
+                {"$inc": fields}, upsert=True))
+    return operations
+
+
+async def apply_change(db: AsyncIOMotorDatabase, old: dict | None = None, new: dict | None = None) -> None:
+    """
+    Update the rollups after a contract was created (no old), updated or
+    deleted (no new). Failures are logged, a rebuild fixes the rollups.
+    """
+    await apply_changes(db, [(old, new)])
+
+
+async def apply_changes(db: AsyncIOMotorDatabase, changes: list[tuple[dict | None, dict | None]]) -> None:
+    """apply_change for many (old, new) contract pairs, in a single bulk write"""
+    increments = new_increments()
+    for old, new in changes:
+        if old is not None:
+            add_contract(increments, old, -1)
+        if new is not None:
+            add_contract(increments, new, 1)
+    operations = update_operations(increments)
+    if not operations:
+        return
+    try:
+        await db.dashboard_rollups.bulk_write(operations, ordered=False)
+    except PyMongoError as ex:
+        logger.error("Could not update the dashboard rollups: %s", ex)
+
+
+def group_query(group: dict) -> dict:
+    return {"group_code": group["group_code"], "dealer_code": group["dealer_code"]}
+
+
+async def mark_built(db: AsyncIOMotorDatabase, group: dict) -> None:
+    await db.dashboard_rollups.update_one(
+        {**group_query(group), "type": None, "month": None},
+        {"$set": {"built": True}}, upsert=True)
+
+
+def rollup_documents(increments: Increments) -> list[dict]:
+    """Whole rollup documents holding the accumulated increments"""
+    documents = []
+    for (group_code, dealer_code, type, month), fields in increments.items():
+        document = {"group_code": group_code, "dealer_code": dealer_code, "type": type, "month": month}
+        for field, value in fields.items():
+            *parents, name = field.split(".")
+            parent = document
+            for key in parents:
+                parent = parent.setdefault(key, {})
+            parent[name] = value
+        documents.append(document)
+    return documents
+
+
+async def rebuild_group(db: AsyncIOMotorDatabase, group: dict, batch_size: int = 1000) -> int:
+    """
+    Recompute the rollups of a group from its contracts, returns the contracts
+    read. The new documents are built in memory, then replace the current ones,
+    so the dashboard never reads half-built rollups. The change made by a
+    contract write during the rebuild may be lost: run it with the contract
+    writes stopped.
+    """
+    increments = new_increments()
+    # the group document exists even without inactive contracts
+    increments[(group["group_code"], group["dealer_code"], None, None)]
+    count = 0
+    async for contract in db.contracts.find(group_query(group), CONTRACT_PROJECTION, batch_size=batch_size):
+        add_contract(increments, contract, 1)
+        count += 1
+    documents = rollup_documents(increments)
+    for document in documents:
+        if document["month"] is None:
+            document["built"] = True
+    operations = [ReplaceOne({key: document[key] for key in ("group_code", "dealer_code", "type", "month")},
+                             document, upsert=True) for document in documents]
+    for i in range(0, len(operations), batch_size):
+        await db.dashboard_rollups.bulk_write(operations[i:i + batch_size], ordered=False)
+    # the months and types that no longer have contracts
+    await db.dashboard_rollups.delete_many({**group_query(group), "$nor": [
+        {"type": document["type"], "month": document["month"]} for document in documents
+    ]})
+    await response_cache.mark_group_changed(db, group)
+    return count
+
+
+async def rebuild_rollups(db: AsyncIOMotorDatabase, batch_size: int = 1000) -> dict:
+    """
+    Rebuild the rollups of every group that has contracts or contract fields,
+    with the contract writes stopped (see rebuild_group)
+    """
+    groups = set()
+    for collection in ("contracts", "contract_fields"):
+        pipeline = [{"$group": {"_id": {"group_code": "$group_code", "dealer_code": "$dealer_code"}}}]
+        async for row in db[collection].aggregate(pipeline):
+            groups.add((row["_id"].get("group_code"), row["_id"].get("dealer_code")))
+    report = {}
+    for group_code, dealer_code in sorted(groups, key=str):
+        group = {"group_code": group_code, "dealer_code": dealer_code}
+        report[f"{group_code}/{dealer_code}"] = await rebuild_group(db, group, batch_size)
+    return report
+
+
+def summarize(key: str, quantity: int, total_value: float) -> dict:
+    """
+    Dashboard group with its average. Totals accumulated with $inc carry
+    float noise, so they are rounded before averaging.
+    """
+    total_value = round(total_value, 2)
+    return {
+        "key": key,
+        "quantity": quantity,
+        "total_value": total_value,
+        "average_value": round(total_value / quantity, 2) if quantity > 0 else 0.0
+    }
+
+
+def summarize_buckets(buckets: dict, names: dict | None = None, top: int | None = None) -> list[dict]:
+    """
+    Turn {key: {quantity, total_value}} into dashboard groups with their
+    average, largest total value first, keeping the top ones when given.
+    names maps the stored keys to the displayed ones.
+    """
+    items = []
+    for key, bucket in buckets.items():
+        if bucket["quantity"] > 0:
+            items.append(summarize(names.get(key, key) if names is not None else key,
+                                   bucket["quantity"], bucket["total_value"]))
+    items.sort(key=lambda item: (-item["total_value"], item["key"]))
+    return items[:top] if top is not None else items
+
+
+async def monthly_dashboard(db: AsyncIOMotorDatabase, group: dict, type: str,
+                            month: datetime) -> dict | None:
+    """
+    Read the monthly dashboard from the rollups with a single keyed query, or
+    None when the rollups of the group have not been built
+    """
+    query = {**group_query(group), "$or": [
+        {"type": type, "month": month_key(month)},
+        {"type": None, "month": None}
+    ]}
+    rollup, totals = {}, {}
+    async for document in db.dashboard_rollups.find(query):
+        if document["month"] is None:
+            totals = document
+        else:
+            rollup = document
+    if not totals.get("built"):
+        return None
+
+    categories = await references.get_categories(db, group)
+    responsibles = await references.get_responsibles(db, group)
+    category_names = {str(id): category["name"] for id, category in categories.items()}
+    responsible_names = {str(id): responsible["name"] for id, responsible in responsibles.items()}
+    quantity = rollup.get("quantity", 0)
+    summary = summarize("", quantity, rollup.get("total_value", 0.0) if quantity > 0 else 0.0)
+    return {
+        "quantity": quantity,
+        "total_value": summary["total_value"],
+        "average_value": summary["average_value"],
+        "by_category": summarize_buckets(rollup.get("by_category", {}), category_names, TOP_BUCKETS),
+        "by_responsible": summarize_buckets(rollup.get("by_responsible", {}), responsible_names, TOP_BUCKETS),
+        "by_periodicity": summarize_buckets(rollup.get("by_periodicity", {})),
+        "inactive_quantity": totals.get("inactive_quantity", 0),
+        "inactive_total_value": round(totals.get("inactive_total_value", 0.0), 2)
+    }
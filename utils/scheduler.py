@@ -0,0 +1,109 @@
+"""
+Periodic background jobs run inside the service.
+
+Every worker runs the loop of each job, but a run only starts after taking
+the job's lease in the job_leases collection, so a job runs in one worker
+at a time. A lease expires on its own if its worker dies mid-run. A job
+scheduled once_per_interval keeps its lease until the interval has passed
+since the start of its last successful run, so the loops of the other
+workers skip it and it runs once per interval overall rather than once per
+worker. The report of every run is kept in the job_runs collection.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[AsyncIOMotorDatabase], Awaitable[dict]]
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_tasks: list[asyncio.Task] = []
+
+
+async def acquire_lease(db: AsyncIOMotorDatabase, name: str, seconds: float) -> bool:
+    """Take or renew the lease of a job, False when another worker holds it"""
+    now = datetime.utcnow()
+    try:
+        await db.job_leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": OWNER}]},
+            {"$set": {"owner": OWNER, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True)
+    except DuplicateKeyError:  # the lease exists and is held by another worker
+        return False
+    return True
+
+
+async def release_lease(db: AsyncIOMotorDatabase, name: str) -> None:
+    await db.job_leases.delete_one({"_id": name, "owner": OWNER})
+
+
+async def hold_lease(db: AsyncIOMotorDatabase, name: str, until: datetime) -> None:
+    await db.job_leases.update_one({"_id": name, "owner": OWNER}, {"$set": {"expires_at": until}})
+
+
+async def run_job(db: AsyncIOMotorDatabase, name: str, job: Job, lease: float,
+                  hold: float = 0) -> dict | None:
+    """
+    Run job once if its lease can be taken, returns and stores its report.
+    After a successful run the lease is kept until hold seconds after the
+    start of the run, a failed run releases it right away.
+    """
+    if not await acquire_lease(db, name, lease):
+        return None
+    started_at = datetime.utcnow()
+    try:
+        report = await job(db)
+    except BaseException:
+        await release_lease(db, name)
+        raise
+    if hold > 0:
+        await hold_lease(db, name, started_at + timedelta(seconds=hold))
+    else:
+        await release_lease(db, name)
+    finished_at = datetime.utcnow()
+    report = {"job": name, "owner": OWNER, "started_at": started_at, "finished_at": finished_at,
+              "seconds": round((finished_at - started_at).total_seconds(), 3), **report}
+    await db.job_runs.insert_one(dict(report))
+    logger.info("Job %s finished: %s", name, report)
+    return report
+
+
+async def run_periodically(db: AsyncIOMotorDatabase, name: str, job: Job,
+                           interval: float, lease: float, once_per_interval: bool) -> None:
+    while True:
+        try:
+            await run_job(db, name, job, lease, interval if once_per_interval else 0)
+        except PyMongoError as ex:
+            logger.warning("Job %s failed, retrying in %ss: %s", name, interval, ex)
+        except Exception:  # a bug must not stop the schedule, cancellation still does
+            logger.exception("Job %s failed, retrying in %ss", name, interval)
+        await asyncio.sleep(interval)
+
+
+def start(db: AsyncIOMotorDatabase, name: str, job: Job, interval: float, lease: float,
+          once_per_interval: bool = False) -> None:
+    """
+    Schedule job to run every interval seconds in this worker, starting now,
+    or once per interval across all the workers when once_per_interval
+    """
+    _tasks.append(asyncio.create_task(run_periodically(db, name, job, interval, lease,
+                                                       once_per_interval)))
+
+
+async def stop() -> None:
+    """Cancel every scheduled job"""
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
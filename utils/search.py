@@ -0,0 +1,48 @@
+"""
+Normalized search keys for contractor names.
+
+Every contract stores search_key, the normalized contractor name, and
+search_tokens, its distinct words. Searches match anchored prefixes of
+those fields so they stay on the group/search_tokens index.
+"""
+import re
+import unicodedata
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+# any run of characters that are not letters or digits, in every script
+SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Casefold text, strip accents and collapse punctuation and spaces into single spaces"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = unicodedata.normalize("NFC", "".join(char for char in text if not unicodedata.combining(char)))
+    return SEPARATORS.sub(" ", text).strip()
+
+
+def search_fields(contractor_name: str) -> dict:
+    """Search fields stored on a contract for its contractor name"""
+    key = normalize(contractor_name)
+    return {
+        "search_key": key,
+        "search_tokens": sorted(set(key.split()))
+    }
+
+
+async def backfill_search_fields(db: AsyncIOMotorDatabase, batch_size: int = 1000) -> dict:
+    """Store the search fields on every contract, in batches of bulk updates"""
+    matched = modified = 0
+    operations = []
+    async for contract in db.contracts.find({}, {"contractor_name": 1}, batch_size=batch_size):
+        operations.append(UpdateOne({"_id": contract["_id"]},
+                                    {"$set": search_fields(contract.get("contractor_name") or "")}))
+        if len(operations) >= batch_size:
+            result = await db.contracts.bulk_write(operations, ordered=False)
+            matched, modified = matched + result.matched_count, modified + result.modified_count
+            operations = []
+    if operations:
+        result = await db.contracts.bulk_write(operations, ordered=False)
+        matched, modified = matched + result.matched_count, modified + result.modified_count
+    return {"matched": matched, "modified": modified}